@@ -0,0 +1,105 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import sys
+import timeit
+
+import numpy as np
+
+from object_detection_retinanet.utils.anchors import anchor_targets_bbox, anchor_targets_bbox_batched, anchors_for_shape
+
+
+def random_group(batch_size, image_shape, num_annotations, num_classes, seed):
+    """ Create a group of image placeholders with random annotations.
+    """
+    random_state = np.random.RandomState(seed)
+    height, width = image_shape
+
+    image_group       = []
+    annotations_group = []
+    for _ in range(batch_size):
+        # images in a batch are usually a bit smaller than the padded batch
+        image_height = random_state.randint(height // 2, height + 1)
+        image_width  = random_state.randint(width // 2, width + 1)
+        image_group.append(np.broadcast_to(np.zeros((), dtype=np.uint8), (image_height, image_width, 3)))
+
+        x1 = random_state.uniform(0, image_width - 16, num_annotations)
+        y1 = random_state.uniform(0, image_height - 16, num_annotations)
+        x2 = np.minimum(x1 + random_state.uniform(16, image_width / 2, num_annotations), image_width)
+        y2 = np.minimum(y1 + random_state.uniform(16, image_height / 2, num_annotations), image_height)
+        annotations_group.append({
+            'bboxes' : np.stack([x1, y1, x2, y2], axis=1),
+            'labels' : random_state.randint(0, num_classes, num_annotations).astype(np.float64),
+        })
+
+    return image_group, annotations_group
+
+
+def check_equal(reference, batched):
+    """ Check that both implementations give the same targets, regression targets are only compared for positive anchors.
+    """
+    regression, labels                 = reference
+    batched_regression, batched_labels = batched
+
+    assert np.array_equal(labels, batched_labels), 'labels differ'
+    assert np.array_equal(regression[:, :, -1], batched_regression[:, :, -1]), 'anchor states differ'
+
+    positive = batched_regression[:, :, -1] == 1
+    assert np.array_equal(regression[positive], batched_regression[positive]), 'regression targets differ'
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Benchmark anchor_targets_bbox_batched against anchor_targets_bbox.')
+    parser.add_argument('--batch-size',      help='Number of images in a group.', type=int, default=8)
+    parser.add_argument('--image-height',    help='Height of the padded batch.', type=int, default=800)
+    parser.add_argument('--image-width',     help='Width of the padded batch.', type=int, default=1333)
+    parser.add_argument('--num-annotations', help='Number of annotations per image.', type=int, default=20)
+    parser.add_argument('--num-classes',     help='Number of classes.', type=int, default=80)
+    parser.add_argument('--repeat',          help='Number of timed runs, the best run is reported.', type=int, default=5)
+    parser.add_argument('--seed',            help='Seed for the random annotations.', type=int, default=0)
+    parser.add_argument('--num-threads',     help='Number of OpenMP threads used to compute the overlaps (0 uses the OpenMP default).', type=int, default=0)
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_args(args)
+
+    image_shape = (args.image_height, args.image_width)
+    anchors     = anchors_for_shape(image_shape + (3,))
+    image_group, annotations_group = random_group(args.batch_size, image_shape, args.num_annotations, args.num_classes, args.seed)
+
+    check_equal(
+        anchor_targets_bbox(anchors, image_group, annotations_group, args.num_classes),
+        anchor_targets_bbox_batched(anchors, image_group, annotations_group, args.num_classes)
+    )
+
+    print('{} anchors, {} images of at most {}x{} with {} annotations each'.format(
+        anchors.shape[0], args.batch_size, args.image_height, args.image_width, args.num_annotations))
+    for function in [anchor_targets_bbox, anchor_targets_bbox_batched]:
+        seconds = min(timeit.repeat(
+            lambda: function(anchors, image_group, annotations_group, args.num_classes, num_threads=args.num_threads),
+            number=1,
+            repeat=args.repeat
+        ))
+        print('{:<30} {:8.1f} ms'.format(function.__name__, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -164,6 +164,47 @@ class RegressBoxes(keras.layers.Layer):
         return config
 
 
+class PreprocessImage(keras.layers.Layer):
+    """ Keras layer for normalizing images inside the model, like utils.image.preprocess_image does outside of it.
+
+    This allows feeding the model uint8 images.
+    """
+
+    def __init__(self, mode='caffe', *args, **kwargs):
+        """ Initializer for the PreprocessImage layer.
+
+        Args
+            mode: One of "caffe" or "tf", see utils.image.preprocess_image.
+        """
+        self.mode = mode
+        super(PreprocessImage, self).__init__(*args, **kwargs)
+
+    def call(self, inputs, **kwargs):
+        image = keras.backend.cast(inputs, keras.backend.floatx())
+
+        if self.mode == 'tf':
+            image = image / 127.5
+            image = image - 1.
+        elif self.mode == 'caffe':
+            mean = np.array([103.939, 116.779, 123.68], dtype=keras.backend.floatx())
+            if keras.backend.image_data_format() == 'channels_first':
+                mean = mean.reshape((3, 1, 1))
+            image = image - keras.backend.constant(mean)
+
+        return image
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+    def get_config(self):
+        config = super(PreprocessImage, self).get_config()
+        config.update({
+            'mode' : self.mode,
+        })
+
+        return config
+
+
 class ClipBoxes(keras.layers.Layer):
     """ Keras layer to clip box values to lie inside a given shape.
     """
@@ -116,3 +116,101 @@ def smooth_l1(sigma=3.0):
         return keras.backend.sum(regression_loss) / normalizer
 
     return _smooth_l1
+
+
+def focal_sparse(alpha=0.25, gamma=2.0):
+    """ Create a functor for computing the focal loss on sparse targets from anchors.anchor_targets_bbox_sparse.
+
+    Args
+        alpha: Scale the focal weight with alpha.
+        gamma: Take the power of the focal weight with gamma.
+
+    Returns
+        A functor that computes the focal loss using the alpha and gamma.
+    """
+    def _focal_sparse(y_true, y_pred):
+        """ Compute the focal loss given the sparse target tensor and the predicted tensor.
+
+        Args
+            y_true: Tensor of target data from the generator with shape (B, N, 1), -1 for ignore, 0 for background and label + 1 for objects.
+            y_pred: Tensor of predicted data from the network with shape (B, N, num_classes).
+
+        Returns
+            The focal loss of y_pred w.r.t. y_true.
+        """
+        codes          = keras.backend.cast(y_true[:, :, 0], 'int32')
+        classification = y_pred
+
+        # filter out "ignore" anchors
+        indices        = object_detection_retinanet.backend.where(keras.backend.not_equal(codes, -1))
+        codes          = object_detection_retinanet.backend.gather_nd(codes, indices)
+        classification = object_detection_retinanet.backend.gather_nd(classification, indices)
+
+        # expand the codes to one-hot labels, background (code 0) has no label
+        labels = keras.backend.one_hot(codes - 1, keras.backend.int_shape(y_pred)[-1])
+        labels = keras.backend.cast(labels, keras.backend.floatx())
+
+        # compute the focal loss
+        alpha_factor = keras.backend.ones_like(labels) * alpha
+        alpha_factor = object_detection_retinanet.backend.where(keras.backend.equal(labels, 1), alpha_factor, 1 - alpha_factor)
+        focal_weight = object_detection_retinanet.backend.where(keras.backend.equal(labels, 1), 1 - classification, classification)
+        focal_weight = alpha_factor * focal_weight ** gamma
+
+        cls_loss = focal_weight * keras.backend.binary_crossentropy(labels, classification)
+
+        # compute the normalizer: the number of positive anchors
+        normalizer = object_detection_retinanet.backend.where(keras.backend.greater(codes, 0))
+        normalizer = keras.backend.cast(keras.backend.shape(normalizer)[0], keras.backend.floatx())
+        normalizer = keras.backend.maximum(keras.backend.cast_to_floatx(1.0), normalizer)
+
+        return keras.backend.sum(cls_loss) / normalizer
+
+    return _focal_sparse
+
+
+def smooth_l1_sparse(sigma=3.0):
+    """ Create a smooth L1 loss functor for sparse targets from anchors.anchor_targets_bbox_sparse.
+
+    Args
+        sigma: This argument defines the point where the loss changes from L2 to L1.
+
+    Returns
+        A functor for computing the smooth L1 loss given target data and predicted data.
+    """
+    sigma_squared = sigma ** 2
+
+    def _smooth_l1_sparse(y_true, y_pred):
+        """ Compute the smooth L1 loss of y_pred w.r.t. the sparse y_true.
+
+        Args
+            y_true: Tensor from the generator of shape (B, P, 5). The first value is the index of a positive anchor (-1 for padding), followed by its regression targets.
+            y_pred: Tensor from the network of shape (B, N, 4).
+
+        Returns
+            The smooth L1 loss of y_pred w.r.t. y_true.
+        """
+        # select the rows of positive anchors, dropping the padding
+        indices           = object_detection_retinanet.backend.where(keras.backend.greater_equal(y_true[:, :, 0], 0))
+        regression_target = object_detection_retinanet.backend.gather_nd(y_true[:, :, 1:], indices)
+
+        # gather the predictions of those anchors
+        anchor_indices    = keras.backend.cast(object_detection_retinanet.backend.gather_nd(y_true[:, :, 0], indices), 'int64')
+        regression        = object_detection_retinanet.backend.gather_nd(y_pred, keras.backend.stack([indices[:, 0], anchor_indices], axis=1))
+
+        # compute smooth L1 loss
+        # f(x) = 0.5 * (sigma * x)^2          if |x| < 1 / sigma / sigma
+        #        |x| - 0.5 / sigma / sigma    otherwise
+        regression_diff = regression - regression_target
+        regression_diff = keras.backend.abs(regression_diff)
+        regression_loss = object_detection_retinanet.backend.where(
+            keras.backend.less(regression_diff, 1.0 / sigma_squared),
+            0.5 * sigma_squared * keras.backend.pow(regression_diff, 2),
+            regression_diff - 0.5 / sigma_squared
+        )
+
+        # compute the normalizer: the number of positive anchors
+        normalizer = keras.backend.maximum(1, keras.backend.shape(indices)[0])
+        normalizer = keras.backend.cast(normalizer, dtype=keras.backend.floatx())
+        return keras.backend.sum(regression_loss) / normalizer
+
+    return _smooth_l1_sparse
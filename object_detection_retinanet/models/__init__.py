@@ -5,6 +5,11 @@ import sys
 class Backbone(object):
     """ This class stores additional information on backbones.
     """
+
+    # the mode of utils.image.preprocess_image used by preprocess_image,
+    # models built with normalize_inputs=True apply it in a layers.PreprocessImage layer instead
+    preprocess_mode = None
+
     def __init__(self, backbone):
         # a dictionary mapping custom layer names to the correct classes
         #from .. import layers
@@ -22,8 +27,11 @@ class Backbone(object):
             'FilterDetections' : object_detection_retinanet.layers.FilterDetections,
             'Anchors'          : object_detection_retinanet.layers.Anchors,
             'ClipBoxes'        : object_detection_retinanet.layers.ClipBoxes,
+            'PreprocessImage'  : object_detection_retinanet.layers.PreprocessImage,
             '_smooth_l1'       : object_detection_retinanet.losses.smooth_l1(),
             '_focal'           : object_detection_retinanet.losses.focal(),
+            '_smooth_l1_sparse': object_detection_retinanet.losses.smooth_l1_sparse(),
+            '_focal_sparse'    : object_detection_retinanet.losses.focal_sparse(),
         }
 
         self.backbone = backbone
@@ -20,6 +20,7 @@ from keras.utils import get_file
 
 from . import retinanet
 from . import Backbone
+from ..layers import PreprocessImage
 from ..utils.image import preprocess_image
 
 
@@ -34,6 +35,8 @@ class DenseNetBackbone(Backbone):
     """ Describes backbone information and provides utility functions.
     """
 
+    preprocess_mode = 'tf'
+
     def retinanet(self, *args, **kwargs):
         """ Returns a retinanet model using the correct backbone.
         """
@@ -67,10 +70,10 @@ class DenseNetBackbone(Backbone):
     def preprocess_image(self, inputs):
         """ Takes as input an image and prepares it for being passed through the network.
         """
-        return preprocess_image(inputs, mode='tf')
+        return preprocess_image(inputs, mode=self.preprocess_mode)
 
 
-def densenet_retinanet(num_classes, backbone='densenet121', inputs=None, modifier=None, **kwargs):
+def densenet_retinanet(num_classes, backbone='densenet121', inputs=None, modifier=None, normalize_inputs=False, **kwargs):
     """ Constructs a retinanet model using a densenet backbone.
 
     Args
@@ -78,16 +81,22 @@ def densenet_retinanet(num_classes, backbone='densenet121', inputs=None, modifie
         backbone: Which backbone to use (one of ('densenet121', 'densenet169', 'densenet201')).
         inputs: The inputs to the network (defaults to a Tensor of shape (None, None, 3)).
         modifier: A function handler which can modify the backbone before using it in retinanet (this can be used to freeze backbone layers for example).
+        normalize_inputs: If True, the model takes uint8 images and normalizes them in a PreprocessImage layer, so they don't have to be preprocessed.
 
     Returns
         RetinaNet model with a DenseNet backbone.
     """
     # choose default input
     if inputs is None:
-        inputs = keras.layers.Input((None, None, 3))
+        inputs = keras.layers.Input((None, None, 3), dtype='uint8' if normalize_inputs else None)
+
+    # normalize the images inside the model
+    image = inputs
+    if normalize_inputs:
+        image = PreprocessImage(mode=DenseNetBackbone.preprocess_mode, name='preprocess_image')(inputs)
 
     blocks, creator = allowed_backbones[backbone]
-    model = creator(input_tensor=inputs, include_top=False, pooling=None, weights=None)
+    model = creator(input_tensor=image, include_top=False, pooling=None, weights=None)
 
     # get last conv layer from the end of each dense block
     layer_outputs = [model.get_layer(name='conv{}_block{}_concat'.format(idx + 2, block_num)).output for idx, block_num in enumerate(blocks)]
@@ -17,6 +17,7 @@ limitations under the License.
 import keras
 from keras.applications import mobilenet
 from keras.utils import get_file
+from ..layers import PreprocessImage
 from ..utils.image import preprocess_image
 
 from . import retinanet
@@ -28,6 +29,7 @@ class MobileNetBackbone(Backbone):
     """
 
     allowed_backbones = ['mobilenet128', 'mobilenet160', 'mobilenet192', 'mobilenet224']
+    preprocess_mode   = 'tf'
 
     def retinanet(self, *args, **kwargs):
         """ Returns a retinanet model using the correct backbone.
@@ -74,10 +76,10 @@ class MobileNetBackbone(Backbone):
     def preprocess_image(self, inputs):
         """ Takes as input an image and prepares it for being passed through the network.
         """
-        return preprocess_image(inputs, mode='tf')
+        return preprocess_image(inputs, mode=self.preprocess_mode)
 
 
-def mobilenet_retinanet(num_classes, backbone='mobilenet224_1.0', inputs=None, modifier=None, **kwargs):
+def mobilenet_retinanet(num_classes, backbone='mobilenet224_1.0', inputs=None, modifier=None, normalize_inputs=False, **kwargs):
     """ Constructs a retinanet model using a mobilenet backbone.
 
     Args
@@ -85,6 +87,7 @@ def mobilenet_retinanet(num_classes, backbone='mobilenet224_1.0', inputs=None, m
         backbone: Which backbone to use (one of ('mobilenet128', 'mobilenet160', 'mobilenet192', 'mobilenet224')).
         inputs: The inputs to the network (defaults to a Tensor of shape (None, None, 3)).
         modifier: A function handler which can modify the backbone before using it in retinanet (this can be used to freeze backbone layers for example).
+        normalize_inputs: If True, the model takes uint8 images and normalizes them in a PreprocessImage layer, so they don't have to be preprocessed.
 
     Returns
         RetinaNet model with a MobileNet backbone.
@@ -93,9 +96,14 @@ def mobilenet_retinanet(num_classes, backbone='mobilenet224_1.0', inputs=None, m
 
     # choose default input
     if inputs is None:
-        inputs = keras.layers.Input((None, None, 3))
+        inputs = keras.layers.Input((None, None, 3), dtype='uint8' if normalize_inputs else None)
 
-    backbone = mobilenet.MobileNet(input_tensor=inputs, alpha=alpha, include_top=False, pooling=None, weights=None)
+    # normalize the images inside the model
+    image = inputs
+    if normalize_inputs:
+        image = PreprocessImage(mode=MobileNetBackbone.preprocess_mode, name='preprocess_image')(inputs)
+
+    backbone = mobilenet.MobileNet(input_tensor=image, alpha=alpha, include_top=False, pooling=None, weights=None)
 
     # create the full model
     layer_names = ['conv_pw_5_relu', 'conv_pw_11_relu', 'conv_pw_13_relu']
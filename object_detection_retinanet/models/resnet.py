@@ -17,11 +17,15 @@ limitations under the License.
 import keras
 from keras.utils import get_file
 import keras_resnet
+import keras_resnet.blocks
+import keras_resnet.layers
 import keras_resnet.models
 
 from . import retinanet
 from . import Backbone
+#from ..layers import PreprocessImage
 #from ..utils.image import preprocess_image
+from object_detection_retinanet.layers import PreprocessImage
 from object_detection_retinanet.utils.image import preprocess_image
 
 
@@ -29,6 +33,8 @@ class ResNetBackbone(Backbone):
     """ Describes backbone information and provides utility functions.
     """
 
+    preprocess_mode = 'caffe'
+
     def __init__(self, backbone):
         super(ResNetBackbone, self).__init__(backbone)
         self.custom_objects.update(keras_resnet.custom_objects)
@@ -73,10 +79,58 @@ class ResNetBackbone(Backbone):
     def preprocess_image(self, inputs):
         """ Takes as input an image and prepares it for being passed through the network.
         """
-        return preprocess_image(inputs, mode='caffe')
+        return preprocess_image(inputs, mode=self.preprocess_mode)
+
+
+def resnet_layers(inputs, backbone='resnet50', freeze_bn=True):
+    """ Applies the layers of a resnet without its top to a tensor, named like the layers of keras_resnet.models.
 
+    keras_resnet.models needs a keras.layers.Input as input, this works on any tensor (for example a normalized image).
+
+    Args
+        inputs: The input tensor.
+        backbone: Which backbone to use (one of ('resnet50', 'resnet101', 'resnet152')).
+        freeze_bn: If True, the BatchNormalization layers are not updated during training.
 
-def resnet_retinanet(num_classes, backbone='resnet50', inputs=None, modifier=None, **kwargs):
+    Returns
+        The outputs of the four stages of the resnet.
+    """
+    if backbone == 'resnet50':
+        blocks, numerical_names = [3, 4, 6, 3], [False, False, False, False]
+    elif backbone == 'resnet101':
+        blocks, numerical_names = [3, 4, 23, 3], [False, True, True, False]
+    elif backbone == 'resnet152':
+        blocks, numerical_names = [3, 8, 36, 3], [False, True, True, False]
+    else:
+        raise ValueError('Backbone (\'{}\') is invalid.'.format(backbone))
+
+    axis = 1 if keras.backend.image_data_format() == 'channels_first' else 3
+
+    x = keras.layers.ZeroPadding2D(padding=3, name='padding_conv1')(inputs)
+    x = keras.layers.Conv2D(64, (7, 7), strides=(2, 2), use_bias=False, name='conv1')(x)
+    x = keras_resnet.layers.BatchNormalization(axis=axis, epsilon=1e-5, freeze=freeze_bn, name='bn_conv1')(x)
+    x = keras.layers.Activation('relu', name='conv1_relu')(x)
+    x = keras.layers.MaxPooling2D((3, 3), strides=(2, 2), padding='same', name='pool1')(x)
+
+    features = 64
+    outputs  = []
+    for stage_id, iterations in enumerate(blocks):
+        for block_id in range(iterations):
+            x = keras_resnet.blocks.bottleneck_2d(
+                features,
+                stage_id,
+                block_id,
+                numerical_name=(block_id > 0 and numerical_names[stage_id]),
+                freeze_bn=freeze_bn
+            )(x)
+
+        features *= 2
+        outputs.append(x)
+
+    return outputs
+
+
+def resnet_retinanet(num_classes, backbone='resnet50', inputs=None, modifier=None, normalize_inputs=False, **kwargs):
     """ Constructs a retinanet model using a resnet backbone.
 
     Args
@@ -84,19 +138,25 @@ def resnet_retinanet(num_classes, backbone='resnet50', inputs=None, modifier=Non
         backbone: Which backbone to use (one of ('resnet50', 'resnet101', 'resnet152')).
         inputs: The inputs to the network (defaults to a Tensor of shape (None, None, 3)).
         modifier: A function handler which can modify the backbone before using it in retinanet (this can be used to freeze backbone layers for example).
+        normalize_inputs: If True, the model takes uint8 images and normalizes them in a PreprocessImage layer, so they don't have to be preprocessed.
 
     Returns
         RetinaNet model with a ResNet backbone.
     """
     # choose default input
     if inputs is None:
+        dtype = 'uint8' if normalize_inputs else None
         if keras.backend.image_data_format() == 'channels_first':
-            inputs = keras.layers.Input(shape=(3, None, None))
+            inputs = keras.layers.Input(shape=(3, None, None), dtype=dtype)
         else:
-            inputs = keras.layers.Input(shape=(None, None, 3))
+            inputs = keras.layers.Input(shape=(None, None, 3), dtype=dtype)
 
     # create the resnet backbone
-    if backbone == 'resnet50':
+    if normalize_inputs:
+        # normalize the images inside the model, in front of the (identically named) resnet layers
+        image  = PreprocessImage(mode=ResNetBackbone.preprocess_mode, name='preprocess_image')(inputs)
+        resnet = keras.models.Model(inputs=inputs, outputs=resnet_layers(image, backbone=backbone), name=backbone)
+    elif backbone == 'resnet50':
         resnet = keras_resnet.models.ResNet50(inputs, include_top=False, freeze_bn=True)
     elif backbone == 'resnet101':
         resnet = keras_resnet.models.ResNet101(inputs, include_top=False, freeze_bn=True)
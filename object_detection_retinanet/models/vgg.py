@@ -20,6 +20,7 @@ from keras.utils import get_file
 
 from . import retinanet
 from . import Backbone
+from ..layers import PreprocessImage
 from ..utils.image import preprocess_image
 
 
@@ -27,6 +28,8 @@ class VGGBackbone(Backbone):
     """ Describes backbone information and provides utility functions.
     """
 
+    preprocess_mode = 'caffe'
+
     def retinanet(self, *args, **kwargs):
         """ Returns a retinanet model using the correct backbone.
         """
@@ -63,10 +66,10 @@ class VGGBackbone(Backbone):
     def preprocess_image(self, inputs):
         """ Takes as input an image and prepares it for being passed through the network.
         """
-        return preprocess_image(inputs, mode='caffe')
+        return preprocess_image(inputs, mode=self.preprocess_mode)
 
 
-def vgg_retinanet(num_classes, backbone='vgg16', inputs=None, modifier=None, **kwargs):
+def vgg_retinanet(num_classes, backbone='vgg16', inputs=None, modifier=None, normalize_inputs=False, **kwargs):
     """ Constructs a retinanet model using a vgg backbone.
 
     Args
@@ -74,19 +77,25 @@ def vgg_retinanet(num_classes, backbone='vgg16', inputs=None, modifier=None, **k
         backbone: Which backbone to use (one of ('vgg16', 'vgg19')).
         inputs: The inputs to the network (defaults to a Tensor of shape (None, None, 3)).
         modifier: A function handler which can modify the backbone before using it in retinanet (this can be used to freeze backbone layers for example).
+        normalize_inputs: If True, the model takes uint8 images and normalizes them in a PreprocessImage layer, so they don't have to be preprocessed.
 
     Returns
         RetinaNet model with a VGG backbone.
     """
     # choose default input
     if inputs is None:
-        inputs = keras.layers.Input(shape=(None, None, 3))
+        inputs = keras.layers.Input(shape=(None, None, 3), dtype='uint8' if normalize_inputs else None)
+
+    # normalize the images inside the model
+    image = inputs
+    if normalize_inputs:
+        image = PreprocessImage(mode=VGGBackbone.preprocess_mode, name='preprocess_image')(inputs)
 
     # create the vgg backbone
     if backbone == 'vgg16':
-        vgg = keras.applications.VGG16(input_tensor=inputs, include_top=False, weights=None)
+        vgg = keras.applications.VGG16(input_tensor=image, include_top=False, weights=None)
     elif backbone == 'vgg19':
-        vgg = keras.applications.VGG19(input_tensor=inputs, include_top=False, weights=None)
+        vgg = keras.applications.VGG19(input_tensor=image, include_top=False, weights=None)
     else:
         raise ValueError("Backbone '{}' not recognized.".format(backbone))
 
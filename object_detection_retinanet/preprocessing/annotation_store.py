@@ -0,0 +1,316 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+def _read_only(array):
+    array = np.asarray(array)
+    array.flags.writeable = False
+    return array
+
+
+def _open_column(path, dtype, shape):
+    """ Memory-map a column file written by AnnotationStoreWriter (an empty column can't be mapped).
+    """
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class AnnotationStore(object):
+    """ Columnar storage of the annotations of all images of a dataset.
+
+    The annotations of all images are stored in contiguous arrays, ordered by image,
+    so the annotations of an image are returned as read-only views without assembling them.
+
+    Args
+        offsets : np.array of shape (N + 1,), the annotations of image i are rows offsets[i] up to offsets[i + 1].
+        bboxes  : np.array of shape (M, 4) for (x1, y1, x2, y2), stored as float32.
+        labels  : np.array of shape (M,), stored as int32.
+        columns : Optional dict of extra columns, each an np.array with M rows, returned with the annotations under its name.
+    """
+
+    def __init__(self, offsets, bboxes, labels, columns=None):
+        self.offsets = _read_only(np.asarray(offsets, dtype=np.int64))
+        self.bboxes  = _read_only(np.asarray(bboxes, dtype=np.float32).reshape((-1, 4)))
+        self.labels  = _read_only(np.asarray(labels, dtype=np.int32).reshape((-1,)))
+        self.columns = dict((name, _read_only(column)) for name, column in (columns or {}).items())
+
+        # set when the store is memory-mapped from a directory, see AnnotationStore.open
+        self.directory = None
+
+        if self.offsets[0] != 0 or self.offsets[-1] != len(self.labels) or np.any(np.diff(self.offsets) < 0):
+            raise ValueError('offsets don\'t describe the {} annotations.'.format(len(self.labels)))
+        for name, column in [('bboxes', self.bboxes)] + list(self.columns.items()):
+            if len(column) != len(self.labels):
+                raise ValueError('Column \'{}\' has {} rows, expected {}.'.format(name, len(column), len(self.labels)))
+
+    @classmethod
+    def from_image_indices(cls, image_indices, bboxes, labels, num_images, columns=None):
+        """ Create a store from annotations in any order, given the image index of each annotation.
+
+        The annotations of an image keep their relative order.
+
+        Args
+            image_indices : np.array of shape (M,) with the image index of each annotation.
+            bboxes        : np.array of shape (M, 4).
+            labels        : np.array of shape (M,).
+            num_images    : The number of images, images without annotations are allowed.
+            columns       : Optional dict of extra columns with M rows.
+        """
+        image_indices = np.asarray(image_indices, dtype=np.int64).reshape((-1,))
+        order         = np.argsort(image_indices, kind='stable')
+        offsets       = np.zeros((num_images + 1,), dtype=np.int64)
+        offsets[1:]   = np.cumsum(np.bincount(image_indices, minlength=num_images))
+
+        def sort(column):
+            column = np.asarray(column)
+            return column if len(column) == 0 else column[order]
+
+        return cls(
+            offsets,
+            sort(np.asarray(bboxes).reshape((-1, 4))),
+            sort(labels),
+            dict((name, sort(column)) for name, column in (columns or {}).items()),
+        )
+
+    @classmethod
+    def open(cls, directory):
+        """ Memory-map a store written by AnnotationStoreWriter.
+
+        Only the pages that are accessed are read, so the resident memory doesn't grow with the size of the store.
+
+        Args
+            directory : The directory the store was written to.
+        """
+        meta_path = os.path.join(directory, 'meta.json')
+        if not os.path.exists(meta_path):
+            raise IOError('\'{}\' doesn\'t contain a complete annotation store.'.format(directory))
+
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+        def column(name, dtype, shape):
+            return _open_column(os.path.join(directory, name + '.bin'), dtype, shape)
+
+        num_annotations = meta['annotations']
+        store = cls(
+            column('offsets', np.int64, (meta['images'] + 1,)),
+            column('bboxes', np.float32, (num_annotations, 4)),
+            column('labels', np.int32, (num_annotations,)),
+            dict((name, column(name, dtype, (num_annotations,))) for name, dtype in meta['columns'].items()),
+        )
+        store.directory = directory
+        return store
+
+    def __len__(self):
+        """ Returns the number of images.
+        """
+        return len(self.offsets) - 1
+
+    def num_annotations(self, image_index=None):
+        """ Returns the number of annotations of an image, or of all images if image_index is None.
+        """
+        if image_index is None:
+            return len(self.labels)
+        return int(self.offsets[image_index + 1] - self.offsets[image_index])
+
+    def get(self, image_index):
+        """ Returns the annotations of an image as a dict of read-only views, with at least 'bboxes' and 'labels'.
+        """
+        start = self.offsets[image_index]
+        end   = self.offsets[image_index + 1]
+
+        annotations = {'bboxes': self.bboxes[start:end], 'labels': self.labels[start:end]}
+        for name, column in self.columns.items():
+            annotations[name] = column[start:end]
+
+        return annotations
+
+    def __getstate__(self):
+        """ Pickle a memory-mapped store by its directory, instead of copying its arrays.
+        """
+        if self.directory is not None:
+            return {'directory': self.directory}
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        """ Unpickled arrays are writeable, make them read-only again.
+        """
+        if state.get('directory') is not None:
+            self.__dict__.update(AnnotationStore.open(state['directory']).__dict__)
+        else:
+            self.__init__(state['offsets'], state['bboxes'], state['labels'], state['columns'])
+
+
+class AnnotationStoreBuilder(object):
+    """ Builds an AnnotationStore by adding the annotations of one image at a time.
+
+    Annotations and the annotation counts of the images are collected in small batches that are converted to arrays,
+    so few Python objects are alive at once, also when many images have no annotations.
+
+    Args
+        columns: Optional dict mapping the names of extra columns to their dtype.
+    """
+
+    chunk_size = 65536
+
+    def __init__(self, columns=None):
+        self.column_dtypes = dict(columns or {})
+        self.counts        = []
+        self.num_images    = 0
+
+        self._count_chunks = []
+        self._chunks       = {'bboxes': [], 'labels': []}
+        self._pending      = {'bboxes': [], 'labels': []}
+        for name in self.column_dtypes:
+            self._chunks[name]  = []
+            self._pending[name] = []
+
+    def _flush(self):
+        dtypes = dict(self.column_dtypes, bboxes=np.float32, labels=np.int32)
+        for name, pending in self._pending.items():
+            if pending:
+                self._chunks[name].append(np.array(pending, dtype=dtypes[name]))
+                del pending[:]
+
+        if self.counts:
+            self._count_chunks.append(np.array(self.counts, dtype=np.int64))
+            del self.counts[:]
+
+    def add_image(self, bboxes=(), labels=(), **columns):
+        """ Add the annotations of the next image.
+
+        Args
+            bboxes  : Sequence of (x1, y1, x2, y2) boxes.
+            labels  : Sequence of labels, one per box.
+            columns : Values of the extra columns, one per box.
+
+        Returns
+            The index of the image.
+        """
+        if len(bboxes) != len(labels):
+            raise ValueError('Got {} bboxes but {} labels.'.format(len(bboxes), len(labels)))
+
+        self._pending['bboxes'].extend(tuple(bbox) for bbox in bboxes)
+        self._pending['labels'].extend(labels)
+        for name in self.column_dtypes:
+            self._pending[name].extend(columns[name])
+
+        self.counts.append(len(labels))
+        self.num_images += 1
+        if len(self._pending['labels']) >= self.chunk_size or len(self.counts) >= self.chunk_size:
+            self._flush()
+
+        return self.num_images - 1
+
+    def build(self):
+        """ Returns the AnnotationStore with all images added so far.
+        """
+        self._flush()
+
+        def concatenate(name, empty_shape, dtype):
+            return np.concatenate(self._chunks[name]) if self._chunks[name] else np.zeros(empty_shape, dtype=dtype)
+
+        counts      = np.concatenate(self._count_chunks) if self._count_chunks else np.zeros((0,), dtype=np.int64)
+        offsets     = np.zeros((len(counts) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        return AnnotationStore(
+            offsets,
+            concatenate('bboxes', (0, 4), np.float32).reshape((-1, 4)),
+            concatenate('labels', (0,), np.int32),
+            dict((name, concatenate(name, (0,), dtype)) for name, dtype in self.column_dtypes.items()),
+        )
+
+
+class AnnotationStoreWriter(AnnotationStoreBuilder):
+    """ Writes an AnnotationStore to a directory by adding the annotations of one image at a time.
+
+    Every chunk of annotations is appended to the column files when it is full,
+    so the memory used while writing doesn't grow with the number of images or annotations.
+    The store is complete once close is called, after which it can be opened with AnnotationStore.open.
+
+    Args
+        directory : The directory to write the store to, it is created if it doesn't exist.
+        columns   : Optional dict mapping the names of extra columns to their dtype.
+    """
+
+    def __init__(self, directory, columns=None):
+        super(AnnotationStoreWriter, self).__init__(columns)
+        self.directory = directory
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # the metadata is written last, an interrupted store is never considered complete
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        self._files = dict((name, open(os.path.join(directory, name + '.bin'), 'wb')) for name in ['offsets'] + list(self._chunks))
+        self._num_annotations = 0
+        np.zeros((1,), dtype=np.int64).tofile(self._files['offsets'])
+
+    def _flush(self):
+        super(AnnotationStoreWriter, self)._flush()
+
+        for name, chunks in self._chunks.items():
+            for chunk in chunks:
+                chunk.tofile(self._files[name])
+            del chunks[:]
+
+        for counts in self._count_chunks:
+            offsets = self._num_annotations + np.cumsum(counts)
+            offsets.tofile(self._files['offsets'])
+            self._num_annotations = int(offsets[-1])
+        del self._count_chunks[:]
+
+    def close(self):
+        """ Write the remaining annotations and the metadata of the store.
+        """
+        self._flush()
+        for f in self._files.values():
+            f.close()
+
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump({
+                'images'      : self.num_images,
+                'annotations' : self._num_annotations,
+                'columns'     : dict((name, np.dtype(dtype).str) for name, dtype in self.column_dtypes.items()),
+            }, f)
+
+    def abort(self):
+        """ Close the files and remove everything that was written, for when writing the store failed.
+        """
+        for f in self._files.values():
+            f.close()
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+        meta_path = os.path.join(self.directory, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+    def build(self):
+        """ Close the writer and returns the written AnnotationStore, memory-mapped.
+        """
+        self.close()
+        return AnnotationStore.open(self.directory)
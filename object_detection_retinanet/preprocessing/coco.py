@@ -14,11 +14,10 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from ..preprocessing.annotation_store import AnnotationStoreBuilder
 from ..preprocessing.generator import Generator
-from ..utils.image import read_image_bgr
 
 import os
-import numpy as np
 
 from pycocotools.coco import COCO
 
@@ -42,6 +41,7 @@ class CocoGenerator(Generator):
         self.image_ids = self.coco.getImgIds()
 
         self.load_classes()
+        self.load_annotation_store()
 
         super(CocoGenerator, self).__init__(**kwargs)
 
@@ -65,6 +65,32 @@ class CocoGenerator(Generator):
         for key, value in self.classes.items():
             self.labels[value] = key
 
+    def load_annotation_store(self):
+        """ Loads the ground truth annotations of all images in the annotation_store.
+        """
+        annotations = AnnotationStoreBuilder()
+        for image_id in self.image_ids:
+            boxes  = []
+            labels = []
+
+            # some images appear to miss annotations (like image with id 257034)
+            for a in self.coco.loadAnns(self.coco.getAnnIds(imgIds=image_id, iscrowd=False)):
+                # some annotations have basically no width / height, skip them
+                if a['bbox'][2] < 1 or a['bbox'][3] < 1:
+                    continue
+
+                labels.append(self.coco_label_to_label(a['category_id']))
+                boxes.append((
+                    a['bbox'][0],
+                    a['bbox'][1],
+                    a['bbox'][0] + a['bbox'][2],
+                    a['bbox'][1] + a['bbox'][3],
+                ))
+
+            annotations.add_image(boxes, labels)
+
+        self.annotation_store = annotations.build()
+
     def size(self):
         """ Size of the COCO dataset.
         """
@@ -111,43 +137,14 @@ class CocoGenerator(Generator):
         """
         return self.coco_labels[label]
 
-    def image_aspect_ratio(self, image_index):
-        """ Compute the aspect ratio for an image with image_index.
+    def image_size(self, image_index):
+        """ Returns the (width, height) of the image with image_index.
         """
         image = self.coco.loadImgs(self.image_ids[image_index])[0]
-        return float(image['width']) / float(image['height'])
+        return image['width'], image['height']
 
-    def load_image(self, image_index):
-        """ Load an image at the image_index.
+    def image_path(self, image_index):
+        """ Returns the image path for image_index.
         """
         image_info = self.coco.loadImgs(self.image_ids[image_index])[0]
-        path       = os.path.join(self.data_dir, 'images', self.set_name, image_info['file_name'])
-        return read_image_bgr(path)
-
-    def load_annotations(self, image_index):
-        """ Load annotations for an image_index.
-        """
-        # get ground truth annotations
-        annotations_ids = self.coco.getAnnIds(imgIds=self.image_ids[image_index], iscrowd=False)
-        annotations     = {'labels': np.empty((0,)), 'bboxes': np.empty((0, 4))}
-
-        # some images appear to miss annotations (like image with id 257034)
-        if len(annotations_ids) == 0:
-            return annotations
-
-        # parse annotations
-        coco_annotations = self.coco.loadAnns(annotations_ids)
-        for idx, a in enumerate(coco_annotations):
-            # some annotations have basically no width / height, skip them
-            if a['bbox'][2] < 1 or a['bbox'][3] < 1:
-                continue
-
-            annotations['labels'] = np.concatenate([annotations['labels'], [self.coco_label_to_label(a['category_id'])]], axis=0)
-            annotations['bboxes'] = np.concatenate([annotations['bboxes'], [[
-                a['bbox'][0],
-                a['bbox'][1],
-                a['bbox'][0] + a['bbox'][2],
-                a['bbox'][1] + a['bbox'][3],
-            ]]], axis=0)
-
-        return annotations
+        return os.path.join(self.data_dir, 'images', self.set_name, image_info['file_name'])
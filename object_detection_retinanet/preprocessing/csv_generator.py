@@ -15,17 +15,18 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+#from .annotation_store import AnnotationStore, AnnotationStoreWriter
 #from .generator import Generator
-#from ..utils.image import read_image_bgr
 
+from object_detection_retinanet.preprocessing.annotation_store import AnnotationStore, AnnotationStoreWriter
 from object_detection_retinanet.preprocessing.generator import Generator
-from object_detection_retinanet.utils.image import read_image_bgr
 
 import numpy as np
-from PIL import Image
 from six import raise_from
 
 import csv
+import hashlib
+import json
 import sys
 import os.path
 from collections import OrderedDict
@@ -64,10 +65,12 @@ def _read_classes(csv_reader):
     return result
 
 
-def _read_annotations(csv_reader, classes):
-    """ Read annotations from the csv_reader.
+def _iter_annotations(csv_reader, classes):
+    """ Parse the annotations from the csv_reader one row at a time.
+
+    Yields
+        (line, img_file, annotation) tuples, annotation is None for a row without annotations.
     """
-    result = OrderedDict()
     for line, row in enumerate(csv_reader):
         line += 1
 
@@ -76,11 +79,9 @@ def _read_annotations(csv_reader, classes):
         except ValueError:
             raise_from(ValueError('line {}: format should be \'img_file,x1,y1,x2,y2,class_name\' or \'img_file,,,,,\''.format(line)), None)
 
-        if img_file not in result:
-            result[img_file] = []
-
         # If a row contains only an image path, it's an image without annotations.
         if (x1, y1, x2, y2, class_name) == ('', '', '', '', ''):
+            yield line, img_file, None
             continue
 
         x1 = _parse(x1, int, 'line {}: malformed x1: {{}}'.format(line))
@@ -98,10 +99,160 @@ def _read_annotations(csv_reader, classes):
         if class_name not in classes:
             raise ValueError('line {}: unknown class name: \'{}\' (classes: {})'.format(line, class_name, classes))
 
-        result[img_file].append({'x1': x1, 'x2': x2, 'y1': y1, 'y2': y2, 'class': class_name})
+        yield line, img_file, {'x1': x1, 'x2': x2, 'y1': y1, 'y2': y2, 'class': class_name}
+
+
+def _read_annotations(csv_reader, classes):
+    """ Read annotations from the csv_reader.
+    """
+    result = OrderedDict()
+    for line, img_file, annotation in _iter_annotations(csv_reader, classes):
+        if img_file not in result:
+            result[img_file] = []
+        if annotation is not None:
+            result[img_file].append(annotation)
     return result
 
 
+class _MappedStrings(object):
+    """ A read-only list of strings, memory-mapped from the files written by index_csv_annotations.
+    """
+
+    def __init__(self, data_path, offsets_path, count):
+        self.data_path    = data_path
+        self.offsets_path = offsets_path
+        self.count        = count
+        self._open()
+
+    def _open(self):
+        self.offsets = np.memmap(self.offsets_path, dtype=np.int64, mode='r', shape=(self.count + 1,))
+        self.data    = np.memmap(self.data_path, dtype=np.uint8, mode='r') if self.offsets[-1] > 0 else np.zeros((0,), dtype=np.uint8)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.count:
+            raise IndexError('index {} out of range for {} strings'.format(index, self.count))
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __getstate__(self):
+        """ Pickle by path, the files are mapped again when unpickled.
+        """
+        return {'data_path': self.data_path, 'offsets_path': self.offsets_path, 'count': self.count}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+
+def _find_duplicate(strings):
+    """ Returns a string that occurs more than once in strings (a _MappedStrings), or None.
+
+    Only a 64 bit hash of every string is kept in memory (with its sort order, 16 bytes per string),
+    strings with the same hash are compared to rule out collisions.
+    """
+    hashes = np.empty((len(strings),), dtype=np.uint64)
+    for start in range(0, len(strings), 65536):
+        end     = min(start + 65536, len(strings))
+        offsets = np.array(strings.offsets[start:end + 1])
+        data    = strings.data[offsets[0]:offsets[-1]].tobytes()
+        offsets = (offsets - offsets[0]).tolist()
+
+        hashes[start:end] = [
+            int.from_bytes(hashlib.blake2b(data[offsets[i]:offsets[i + 1]], digest_size=8).digest(), 'little')
+            for i in range(end - start)
+        ]
+
+    order  = np.argsort(hashes, kind='stable')
+    hashes = hashes[order]
+    for start in np.flatnonzero(hashes[1:] == hashes[:-1]):
+        end   = start + 1
+        while end < len(hashes) and hashes[end] == hashes[start]:
+            end += 1
+        names = [strings[i] for i in order[start:end]]
+        if len(set(names)) < len(names):
+            return next(name for name in names if names.count(name) > 1)
+
+    return None
+
+
+def index_csv_annotations(csv_data_file, csv_class_file, index_dir, check_contiguous=True):
+    """ Read a CSV annotations file in chunks into an index on disk, to be used with CSVGenerator(annotation_index=index_dir).
+
+    The file is streamed and the index is memory-mapped, so the memory used by reading the file and by using the index stays flat,
+    regardless of the number of images and annotations.
+    The rows of an image have to be contiguous in the file. Checking this takes a second pass over the written image names,
+    which keeps 16 bytes per image in memory.
+
+    Args
+        csv_data_file    : Path to the CSV annotations file, with rows 'img_file,x1,y1,x2,y2,class_name' or 'img_file,,,,,'.
+        csv_class_file   : Path to the CSV classes file, with rows 'class_name,class_id'.
+        index_dir        : Directory to write the index to.
+        check_contiguous : Raise a ValueError if the rows of an image are not contiguous.
+                           Without the check such an image is indexed once for every run of rows, as separate images.
+
+    Returns
+        The number of images in the index.
+    """
+    with _open_for_csv(csv_class_file) as file:
+        classes = _read_classes(csv.reader(file, delimiter=','))
+
+    writer            = AnnotationStoreWriter(index_dir)
+    names_path        = os.path.join(index_dir, 'image_names.bin')
+    name_offsets_path = os.path.join(index_dir, 'image_names.offsets.bin')
+    classes_path      = os.path.join(index_dir, 'classes.json')
+
+    try:
+        # image names are written as concatenated utf-8 strings, with their offsets
+        with open(names_path, 'wb') as names, open(name_offsets_path, 'wb') as name_offsets:
+            name_offsets.write(np.zeros((1,), dtype=np.int64).tobytes())
+            image, boxes, labels = None, [], []
+
+            def add_image():
+                writer.add_image(boxes, labels)
+                names.write(image.encode('utf-8'))
+                name_offsets.write(np.array([names.tell()], dtype=np.int64).tobytes())
+
+            with _open_for_csv(csv_data_file) as file:
+                for line, img_file, annotation in _iter_annotations(csv.reader(file, delimiter=','), classes):
+                    if img_file != image:
+                        if image is not None:
+                            add_image()
+                        image, boxes, labels = img_file, [], []
+
+                    if annotation is not None:
+                        boxes.append((annotation['x1'], annotation['y1'], annotation['x2'], annotation['y2']))
+                        labels.append(classes[annotation['class']])
+
+            if image is not None:
+                add_image()
+
+        if check_contiguous:
+            # every run of rows was written as an image, so an image with non-contiguous rows has a duplicate name
+            duplicate = _find_duplicate(_MappedStrings(
+                names_path,
+                name_offsets_path,
+                writer.num_images,
+            ))
+            if duplicate is not None:
+                raise ValueError('the rows of image \'{}\' in \'{}\' are not contiguous'.format(duplicate, csv_data_file))
+
+        # the classes are written before the store is closed, a complete store always has them
+        with open(classes_path, 'w') as f:
+            json.dump([[name, label] for name, label in classes.items()], f)
+        writer.close()
+    except BaseException:
+        # remove the partial index, so it can't be mistaken for a complete one
+        writer.abort()
+        for path in [names_path, name_offsets_path, classes_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    return writer.num_images
+
+
 def _open_for_csv(path):
     """ Open a file with flags suitable for csv.reader.
 
@@ -127,51 +278,76 @@ class CSVGenerator(Generator):
         base_dir,
         batch_size,
         backbone,
+        annotation_index=None,
         **kwargs
     ):
         """ Initialize a CSV data generator.
 
         Args
-            csv_data_file: Path to the CSV annotations file.
-            csv_class_file: Path to the CSV classes file.
-            base_dir: Directory w.r.t. where the files are to be searched (defaults to the directory containing the csv_data_file).
+            annotation_df: DataFrame with the annotations, with columns img_file, x1, y1, x2, y2, class_name (an empty class_name marks an image without annotations).
+                           Must be None when annotation_index is used.
+            classes_df: DataFrame with the classes, with columns class_name, class_id. Must be None when annotation_index is used.
+            base_dir: Directory w.r.t. where the image files are to be searched.
+            annotation_index: Directory written by index_csv_annotations, to memory-map the classes and annotations from instead of annotation_df and classes_df.
         """
 
         self.image_names = []
-        self.image_data  = {}
         self.base_dir    = base_dir
 
-        # Parse annotations
-        annotation_dict = OrderedDict()
+        if annotation_index is not None:
+            if annotation_df is not None or classes_df is not None:
+                raise ValueError('annotation_df and classes_df must be None when annotation_index is used.')
+            self.load_index(annotation_index)
+        else:
+            self.load_data_frames(annotation_df, classes_df)
 
-        for index, row in annotation_df.iterrows():
-            img_file, x1, y1, x2, y2, class_name = row[:6]
-
-            if img_file not in annotation_dict:
-                annotation_dict[img_file] = []
-                
-            annotation_dict[img_file].append({'x1': x1, 'x2': x2, 'y1': y1, 'y2': y2, 'class': class_name})
+        super(CSVGenerator, self).__init__(**kwargs)
 
+    def load_data_frames(self, annotation_df, classes_df):
+        """ Parse the classes and annotations from data frames, column-wise.
+        """
         # Parse classes
-        classes_dict = OrderedDict()
+        self.classes = OrderedDict(zip(classes_df.iloc[:, 0], (int(class_id) for class_id in classes_df.iloc[:, 1])))
+        self.labels = {}
+        for key, value in self.classes.items():
+            self.labels[value] = key
 
-        for index, row in classes_df.iterrows():
-            class_name, class_id = row
-            classes_dict[class_name] = class_id
-    
-        # Create image data
-        self.image_data = annotation_dict
-        self.image_names = list(self.image_data.keys())
-        
-        # Other derived vars
-        self.classes = classes_dict
+        # Parse annotations column-wise, images are numbered in the order in which they first appear
+        image_indices, image_names = annotation_df.iloc[:, 0].factorize(sort=False)
+        class_names = annotation_df.iloc[:, 5]
+
+        # If a row contains only an image path, it's an image without annotations.
+        annotated = ~(class_names.isnull() | (class_names == '')).to_numpy()
+
+        labels  = class_names[annotated].map(self.classes)
+        unknown = labels.isnull().to_numpy()
+        if unknown.any():
+            raise ValueError('unknown class names: {} (classes: {})'.format(sorted(set(class_names[annotated][unknown])), self.classes))
+
+        self.image_names      = list(image_names)
+        self.annotation_store = AnnotationStore.from_image_indices(
+            image_indices[annotated],
+            annotation_df.iloc[annotated, 1:5].to_numpy(dtype=np.float32),
+            labels.to_numpy(dtype=np.int32),
+            len(self.image_names),
+        )
+
+    def load_index(self, index_dir):
+        """ Memory-map the classes, image names and annotations from an index written by index_csv_annotations.
+        """
+        self.annotation_store = AnnotationStore.open(index_dir)
+
+        with open(os.path.join(index_dir, 'classes.json'), 'r') as f:
+            self.classes = OrderedDict((name, label) for name, label in json.load(f))
         self.labels = {}
         for key, value in self.classes.items():
             self.labels[value] = key
-        
-        self.base_dir = base_dir
 
-        super(CSVGenerator, self).__init__(**kwargs)
+        self.image_names = _MappedStrings(
+            os.path.join(index_dir, 'image_names.bin'),
+            os.path.join(index_dir, 'image_names.offsets.bin'),
+            len(self.annotation_store),
+        )
 
     def size(self):
         """ Size of the dataset.
@@ -207,33 +383,3 @@ class CSVGenerator(Generator):
         """ Returns the image path for image_index.
         """
         return os.path.join(self.base_dir, self.image_names[image_index])
-
-    def image_aspect_ratio(self, image_index):
-        """ Compute the aspect ratio for an image with image_index.
-        """
-        # PIL is fast for metadata
-        image = Image.open(self.image_path(image_index))
-        return float(image.width) / float(image.height)
-
-    def load_image(self, image_index):
-        """ Load an image at the image_index.
-        """
-        #print(self.image_path(image_index))
-        return read_image_bgr(self.image_path(image_index))
-
-    def load_annotations(self, image_index):
-        """ Load annotations for an image_index.
-        """
-        path        = self.image_names[image_index]
-        annotations = {'labels': np.empty((0,)), 'bboxes': np.empty((0, 4))}
-
-        for idx, annot in enumerate(self.image_data[path]):
-            annotations['labels'] = np.concatenate((annotations['labels'], [self.name_to_label(annot['class'])]))
-            annotations['bboxes'] = np.concatenate((annotations['bboxes'], [[
-                float(annot['x1']),
-                float(annot['y1']),
-                float(annot['x2']),
-                float(annot['y2']),
-            ]]))
-
-        return annotations
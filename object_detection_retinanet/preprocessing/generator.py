@@ -14,15 +14,18 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import hashlib
 import numpy as np
 import random
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 import tensorflow as tf
 import keras
 
 # from ..utils.anchors import (
-#     anchor_targets_bbox,
-#     anchors_for_shape,
+#     anchor_targets_bbox_batched,
+#     cached_anchors_for_shape,
 #     guess_shapes
 # )
 # from ..utils.config import parse_anchor_parameters
@@ -33,11 +36,13 @@ import keras
 #     preprocess_image,
 #     resize_image,
 # )
-# from ..utils.transform import transform_aabb
+# from ..utils.transform import transform_aabbs
+# from ..utils.cache import BufferPool, ImageCache, ImageSizeIndex, ResizedImageCache
 
+from object_detection_retinanet.utils.cache import BufferPool, ImageCache, ImageSizeIndex, ResizedImageCache
 from object_detection_retinanet.utils.anchors import (
-    anchor_targets_bbox,
-    anchors_for_shape,
+    anchor_targets_bbox_batched,
+    cached_anchors_for_shape,
     guess_shapes
 )
 from object_detection_retinanet.utils.config import parse_anchor_parameters
@@ -45,44 +50,83 @@ from object_detection_retinanet.utils.image import (
     TransformParameters,
     adjust_transform_for_image,
     apply_transform,
+    compute_resize_scale,
     preprocess_image,
+    read_image_bgr,
+    read_image_bgr_scaled,
+    read_image_size,
     resize_image,
+    resized_shape,
 )
-from object_detection_retinanet.utils.transform import transform_aabb
+from object_detection_retinanet.utils.transform import transform_aabbs
 
 
 class Generator(keras.utils.Sequence):
     """ Abstract generator class.
     """
 
+    # subclasses load their annotations in an AnnotationStore, load_annotations returns read-only views of it
+    annotation_store = None
+
     def __init__(
         self,
         transform_generator = None,
         visual_effect_generator=None,
         batch_size=1,
-        group_method='ratio',  # one of 'none', 'random', 'ratio'
+        group_method='ratio',  # one of 'none', 'random', 'ratio', 'bucket'
         shuffle_groups=True,
         image_min_side=800,
         image_max_side=1333,
         transform_parameters=None,
-        compute_anchor_targets=anchor_targets_bbox,
+        compute_anchor_targets=anchor_targets_bbox_batched,
         compute_shapes=guess_shapes,
         preprocess_image=preprocess_image,
-        config=None
+        config=None,
+        num_io_workers=1,
+        image_cache_bytes=0,
+        resized_cache_dir=None,
+        image_size_index=None,
+        batch_buffer_queue_size=0,
+        bucket_stride=None,
+        single_resample=False,
+        reduced_decoding=False,
+        uint8_inputs=False,
+        image_source=None,
+        num_overlap_threads=0
     ):
         """ Initialize Generator object.
 
         Args
             transform_generator    : A generator used to randomly transform images and annotations.
             batch_size             : The size of the batches to generate.
-            group_method           : Determines how images are grouped together (defaults to 'ratio', one of ('none', 'random', 'ratio')).
+            group_method           : Determines how images are grouped together (defaults to 'ratio', one of ('none', 'random', 'ratio', 'bucket')).
+                                     'bucket' groups images by their height and width after resizing, which minimizes the padding in a batch.
             shuffle_groups         : If True, shuffles the groups each epoch.
             image_min_side         : After resizing the minimum side of an image is equal to image_min_side.
             image_max_side         : If after resizing the maximum side is larger than image_max_side, scales down further so that the max side is equal to image_max_side.
             transform_parameters   : The transform parameters used for data augmentation.
             compute_anchor_targets : Function handler for computing the targets of anchors for an image and its annotations.
+                                     Use anchor_targets_bbox_sparse for a compact encoding, trained with losses.focal_sparse and losses.smooth_l1_sparse.
             compute_shapes         : Function handler for computing the shapes of the pyramid for a given input.
             preprocess_image       : Function handler for preprocessing an image (scaling / normalizing) for passing through a network.
+            num_io_workers         : Number of threads used to load the images of a group concurrently (1 loads them sequentially).
+            image_cache_bytes      : Size in bytes of an in-memory LRU cache for decoded images (0 disables the cache). A PrefetchGenerator splits it across its workers.
+            resized_cache_dir      : If set, all images are resized to image_min_side / image_max_side once and stored as uint8 in a memory-mapped cache in this directory.
+            image_size_index       : Path of a file in which the image sizes are indexed, so grouping by aspect ratio doesn't have to open every image (for example next to the annotations).
+            batch_buffer_queue_size: If > 0, input batches are assembled in preallocated buffers and returned without copying them into a tensor. Set it to the max_queue_size passed to keras,
+                                     a buffer is reused after max_queue_size + 2 batches of the same shape (the queued batches, the batch that is trained on and the batch that is put in the queue).
+                                     Buffers are only reused for repeated batch shapes, so this is meant to be combined with bucket_stride.
+            bucket_stride          : If set, the height and width of batches are rounded up to a multiple of this value, which limits the number of distinct batch shapes.
+            single_resample        : If True, the random transformation and the resize are combined in a single warp of the uint8 image to the output size.
+                                     This is faster, but the output differs slightly from transforming and resizing in separate steps.
+            reduced_decoding       : If True, JPEG images are decoded at 1/2, 1/4 or 1/8 of their size when they are resized by at least that much anyway.
+                                     This is much faster for large images, but the output differs slightly from decoding at full size.
+            uint8_inputs           : If True, images are not preprocessed and batches hold uint8 pixels, for models that normalize their inputs themselves
+                                     (see the normalize_inputs argument of the backbones). This moves a quarter of the bytes of float32 batches.
+            image_source           : If set, images are read from this source (for example a utils.archive.ArchiveImageSource) instead of from files on disk.
+                                     It has to provide open(path), returning a file object for the image_path of an image.
+            num_overlap_threads    : Number of OpenMP threads used to compute the overlaps of anchors and annotations (0 uses the OpenMP default, usually all cores).
+                                     Lower it when batches are computed in several processes, see preprocessing.prefetch.PrefetchGenerator.
         """
         self.transform_generator    = transform_generator
         self.visual_effect_generator = visual_effect_generator
@@ -96,6 +140,43 @@ class Generator(keras.utils.Sequence):
         self.compute_shapes         = compute_shapes
         self.preprocess_image       = preprocess_image
         self.config                 = config
+        self.anchor_params          = None
+        self.num_io_workers         = max(1, int(num_io_workers))
+        self._io_executor           = None
+        self._random_lock           = threading.Lock()
+        self.image_cache            = ImageCache(image_cache_bytes) if image_cache_bytes else None
+        self.resized_cache          = None
+        self.image_sizes            = None
+        self.batch_buffers          = BufferPool(batch_buffer_queue_size + 2) if batch_buffer_queue_size else None
+        self.bucket_stride          = int(bucket_stride) if bucket_stride else None
+        self.padding_fraction       = None
+        self.resized_shapes         = None
+        self.single_resample        = single_resample
+        self.reduced_decoding       = reduced_decoding
+        self.uint8_inputs           = uint8_inputs
+        self.image_source           = image_source
+        self.num_overlap_threads    = int(num_overlap_threads)
+
+        if self.batch_buffers is not None and not self.bucket_stride:
+            warnings.warn(
+                'batch_buffer_queue_size is set without bucket_stride, batch shapes rarely repeat so few buffers will be reused.'
+            )
+
+        # Parse the anchor parameters once, they are needed for every batch
+        if self.config and 'anchor_parameters' in self.config:
+            self.anchor_params = parse_anchor_parameters(self.config)
+
+        # Index the image sizes, reading the headers of new or changed images only
+        if image_size_index is not None and image_source is not None:
+            raise ValueError('image_size_index indexes image files on disk, it can\'t be combined with an image_source.')
+        if image_size_index is not None:
+            self.image_sizes = ImageSizeIndex(image_size_index)
+            self.image_sizes.update((self.image_path(i) for i in range(self.size())), map_function=self._map_group)
+
+        # Build or reuse the cache of resized images
+        if resized_cache_dir is not None:
+            self.resized_cache = ResizedImageCache(resized_cache_dir, self.image_min_side, self.image_max_side)
+            self.prepare_resized_cache()
 
         # Define groups
         self.group_images()
@@ -108,6 +189,9 @@ class Generator(keras.utils.Sequence):
         if self.shuffle_groups:
             random.shuffle(self.groups)
 
+        if self.resized_shapes is not None:
+            self.padding_fraction = self.compute_padding_fraction(self.resized_shapes)
+
     def size(self):
         """ Size of the dataset.
         """
@@ -138,20 +222,128 @@ class Generator(keras.utils.Sequence):
         """
         raise NotImplementedError('label_to_name method not implemented')
 
+    def image_size(self, image_index):
+        """ Returns the (width, height) of the image with image_index.
+        """
+        if self.image_sizes is not None:
+            return self.image_sizes.size(self.image_path(image_index))
+        return read_image_size(self.image_file(image_index))
+
     def image_aspect_ratio(self, image_index):
         """ Compute the aspect ratio for an image with image_index.
         """
-        raise NotImplementedError('image_aspect_ratio method not implemented')
+        width, height = self.image_size(image_index)
+        return float(width) / float(height)
+
+    def resized_image_shape(self, image_index):
+        """ Returns the (height, width) of the image with image_index after it is resized by preprocess_group_entry.
+        """
+        width, height = self.image_size(image_index)
+        scale = compute_resize_scale((height, width, 3), min_side=self.image_min_side, max_side=self.image_max_side)
+        return resized_shape((height, width), scale)
+
+    def image_path(self, image_index):
+        """ Returns the path of the image with image_index.
+        """
+        raise NotImplementedError('image_path method not implemented')
+
+    def image_file(self, image_index):
+        """ Returns the path of the image with image_index, or a file object with the encoded image if it is read from an image_source.
+        """
+        path = self.image_path(image_index)
+        if self.image_source is not None:
+            return self.image_source.open(path)
+        return path
+
+    def read_image(self, image_index):
+        """ Read and decode the image at the image_index, bypassing any cache.
+        """
+        return read_image_bgr(self.image_file(image_index))
+
+    def read_scaled_image(self, image_index):
+        """ Read and decode the image at the image_index at a reduced resolution if it is resized by at least half, bypassing any cache.
+
+        Returns
+            The image and the scale of the decoded image w.r.t. the original image.
+        """
+        return read_image_bgr_scaled(self.image_file(image_index), min_side=self.image_min_side, max_side=self.image_max_side)
 
     def load_image(self, image_index):
         """ Load an image at the image_index.
+
+        If an image cache is configured, decoded images are kept in it and returned read-only.
+        """
+        if self.image_cache is None:
+            return self.read_image(image_index)
+
+        image = self.image_cache.get(image_index)
+        if image is None:
+            image = self.read_image(image_index)
+            image.flags.writeable = False
+            self.image_cache.put(image_index, image)
+
+        return image
+
+    def load_scaled_image(self, image_index):
+        """ Load an image at the image_index, possibly already resized towards the input size of the network.
+
+        Returns
+            The image and the scale that was applied to it w.r.t. the original image.
+        """
+        if self.resized_cache is not None:
+            return self.resized_cache.get(image_index)
+        if not self.reduced_decoding:
+            return self.load_image(image_index), 1.0
+        if self.image_cache is None:
+            return self.read_scaled_image(image_index)
+
+        # cached separately from the full size images of load_image
+        key    = ('scaled', image_index)
+        cached = self.image_cache.get(key)
+        if cached is None:
+            cached = self.read_scaled_image(image_index)
+            cached[0].flags.writeable = False
+            self.image_cache.put(key, cached, nbytes=cached[0].nbytes)
+
+        return cached
+
+    def dataset_fingerprint(self):
+        """ Returns a string identifying the images of the dataset.
         """
-        raise NotImplementedError('load_image method not implemented')
+        digest = hashlib.sha1()
+        for image_index in range(self.size()):
+            digest.update(self.image_path(image_index).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def prepare_resized_cache(self):
+        """ Build the cache of resized images, unless a valid cache for this dataset already exists.
+        """
+        fingerprint = self.dataset_fingerprint()
+        if not self.resized_cache.is_valid(fingerprint):
+            self.resized_cache.build(self._iterate_resized_images(), fingerprint)
+
+    def _iterate_resized_images(self):
+        """ Yields every image of the dataset resized using image_min_side and image_max_side, together with its scale.
+        """
+        def read_resized(image_index):
+            return self.resize_image(self.read_image(image_index))
+
+        # work in chunks, so decoded images don't pile up when writing is slower than decoding
+        chunk_size = 4 * self.num_io_workers
+        for start in range(0, self.size(), chunk_size):
+            chunk = range(start, min(start + chunk_size, self.size()))
+            for image, scale in self._map_group(read_resized, chunk):
+                yield image, scale
 
     def load_annotations(self, image_index):
         """ Load annotations for an image_index.
+
+        The arrays are read-only views of the annotation_store, they can't be modified in place.
         """
-        raise NotImplementedError('load_annotations method not implemented')
+        if self.annotation_store is None:
+            raise NotImplementedError('load_annotations method not implemented')
+        return self.annotation_store.get(image_index)
 
     def load_annotations_group(self, group):
         """ Load annotations for all images in group.
@@ -191,15 +383,98 @@ class Generator(keras.utils.Sequence):
 
         return image_group, annotations_group
 
+    def io_executor(self):
+        """ Returns the thread pool used for loading images, creating it on first use.
+        """
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(max_workers=self.num_io_workers)
+        return self._io_executor
+
+    def _map_group(self, function, group):
+        """ Apply function to every image index in group, concurrently if num_io_workers > 1.
+
+        The order of the result matches the group.
+        """
+        if self.num_io_workers == 1 or len(group) == 1:
+            return [function(image_index) for image_index in group]
+        return list(self.io_executor().map(function, group))
+
     def load_image_group(self, group):
         """ Load images for all images in a group.
+
+        With num_io_workers > 1 the images are read and decoded concurrently.
+        """
+        return self._map_group(self.load_image, group)
+
+    def load_scaled_image_group(self, group):
+        """ Load images for all images in a group, possibly already resized (see load_scaled_image).
+
+        Returns
+            A list of images and a list of the scales that were applied to them.
+        """
+        loaded = self._map_group(self.load_scaled_image, group)
+        return [image for image, _ in loaded], [scale for _, scale in loaded]
+
+    def __getstate__(self):
+        """ Drop the thread pool and lock when pickling, they are recreated after unpickling.
+        """
+        state = self.__dict__.copy()
+        state['_io_executor'] = None
+        del state['_random_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._random_lock = threading.Lock()
+
+    def after_fork(self):
+        """ Reset the state that doesn't survive a fork, call this in a forked process before using the generator.
+
+        The threads of the parent don't exist in a forked process, so its thread pool is dropped and locks that may
+        have been held by those threads are recreated, together with the caches they guard.
+        """
+        self._io_executor = None
+        self._random_lock = threading.Lock()
+        if self.image_cache is not None:
+            self.image_cache = ImageCache(self.image_cache.max_bytes)
+        if self.batch_buffers is not None:
+            self.batch_buffers = BufferPool(self.batch_buffers.buffers_per_shape, self.batch_buffers.max_shapes)
+        if hasattr(self.image_source, 'after_fork'):
+            self.image_source.after_fork()
+
+    def reseed_augmentation(self, seed):
+        """ Reseed the random state of the augmentations, for example in each process that computes batches.
+
+        Reseeds the global `random` and `np.random` state, and the PRNG of the transform generator if it exposes one
+        (see utils.transform.RandomTransformGenerator).
+
+        Args
+            seed: An int or a sequence of ints.
+        """
+        seeds = np.random.RandomState(seed).randint(0, 2 ** 31, size=3)
+        random.seed(int(seeds[0]))
+        np.random.seed(seeds[1])
+
+        prng = getattr(self.transform_generator, 'prng', None)
+        if prng is not None:
+            prng.seed(seeds[2])
+
+    def next_visual_effect(self):
+        """ Draw the next visual effect, safe to call from multiple threads.
+        """
+        with self._random_lock:
+            return next(self.visual_effect_generator)
+
+    def next_transform(self):
+        """ Draw the next random transformation, safe to call from multiple threads.
         """
-        return [self.load_image(image_index) for image_index in group]
+        with self._random_lock:
+            return next(self.transform_generator)
 
     def random_visual_effect_group_entry(self, image, annotations):
         """ Randomly transforms image and annotation.
         """
-        visual_effect = next(self.visual_effect_generator)
+        visual_effect = self.next_visual_effect()
         # apply visual effect
         image = visual_effect(image)
         return image, annotations
@@ -227,15 +502,13 @@ class Generator(keras.utils.Sequence):
         # randomly transform both image and annotations
         if transform is not None or self.transform_generator:
             if transform is None:
-                transform = adjust_transform_for_image(next(self.transform_generator), image, self.transform_parameters.relative_translation)
+                transform = adjust_transform_for_image(self.next_transform(), image, self.transform_parameters.relative_translation)
 
             # apply transformation to image
             image = apply_transform(transform, image, self.transform_parameters)
 
             # Transform the bounding boxes in the annotations.
-            annotations['bboxes'] = annotations['bboxes'].copy()
-            for index in range(annotations['bboxes'].shape[0]):
-                annotations['bboxes'][index, :] = transform_aabb(transform, annotations['bboxes'][index, :])
+            annotations['bboxes'] = transform_aabbs(transform, annotations['bboxes'])
 
         return image, annotations
 
@@ -256,23 +529,78 @@ class Generator(keras.utils.Sequence):
         """
         return resize_image(image, min_side=self.image_min_side, max_side=self.image_max_side)
 
+    def input_dtype(self):
+        """ Returns the dtype of the images in the input batches.
+        """
+        return np.uint8 if self.uint8_inputs else keras.backend.floatx()
+
+    def preprocess_input_image(self, image):
+        """ Preprocess an image for the network and convert it to input_dtype.
+
+        With uint8_inputs the pixels are kept as they are, the model normalizes them.
+        """
+        if not self.uint8_inputs:
+            image = self.preprocess_image(image)
+
+        return image.astype(self.input_dtype(), copy=False)
+
     def preprocess_group_entry(self, image, annotations):
         """ Preprocess image and its annotations.
         """
-        # preprocess the image
-        image = self.preprocess_image(image)
+        # preprocess the image, unless the model normalizes the uint8 pixels itself
+        if not self.uint8_inputs:
+            image = self.preprocess_image(image)
 
         # resize image
         image, image_scale = self.resize_image(image)
 
-        # apply resizing to annotations too
-        annotations['bboxes'] *= image_scale
+        # apply resizing to annotations too (out of place, they can be views of the annotation store)
+        annotations['bboxes'] = annotations['bboxes'] * image_scale
 
-        # convert to the wanted keras floatx
-        image = keras.backend.cast_to_floatx(image)
+        # convert to the wanted keras floatx (or uint8)
+        image = image.astype(self.input_dtype(), copy=False)
 
         return image, annotations
 
+    def transform_resize_group_entry(self, image, annotations):
+        """ Randomly transform, resize and preprocess an image and its annotations, resampling the image only once.
+        """
+        scale = compute_resize_scale(image.shape, min_side=self.image_min_side, max_side=self.image_max_side)
+
+        if self.transform_generator:
+            transform = adjust_transform_for_image(self.next_transform(), image, self.transform_parameters.relative_translation)
+
+            # resize after transforming, the warp goes straight to the output size
+            transform    = np.dot(np.diag([scale, scale, 1]), transform)
+            output_shape = resized_shape(image.shape, scale)
+            image        = apply_transform(transform, image, self.transform_parameters, output_shape=output_shape)
+
+            annotations['bboxes'] = transform_aabbs(transform, annotations['bboxes'])
+        else:
+            image, scale = self.resize_image(image)
+            annotations['bboxes'] = annotations['bboxes'] * scale
+
+        # preprocess the (smaller) image
+        image = self.preprocess_input_image(image)
+
+        return image, annotations
+
+    def transform_preprocess_group(self, image_group, annotations_group):
+        """ Randomly transform, then preprocess and resize each image and its annotations.
+
+        Uses transform_resize_group_entry if single_resample is set, random_transform_group and preprocess_group otherwise.
+        """
+        if not self.single_resample:
+            image_group, annotations_group = self.random_transform_group(image_group, annotations_group)
+            return self.preprocess_group(image_group, annotations_group)
+
+        assert(len(image_group) == len(annotations_group))
+
+        for index in range(len(image_group)):
+            image_group[index], annotations_group[index] = self.transform_resize_group_entry(image_group[index], annotations_group[index])
+
+        return image_group, annotations_group
+
     def preprocess_group(self, image_group, annotations_group):
         """ Preprocess each image and its annotations in its group.
         """
@@ -293,18 +621,64 @@ class Generator(keras.utils.Sequence):
             random.shuffle(order)
         elif self.group_method == 'ratio':
             order.sort(key=lambda x: self.image_aspect_ratio(x))
+        elif self.group_method == 'bucket':
+            # order by the shape after resizing, following the aspect ratio so both landscape and portrait shapes stay adjacent
+            # the shapes are kept to compute the padding fraction without resizing every image again
+            shapes = self.resized_shapes = [self.resized_image_shape(x) for x in order]
+            order.sort(key=lambda x: (float(shapes[x][1]) / shapes[x][0],) + shapes[x])
 
         # divide into groups, one group = one batch
         self.groups = [[order[x % len(order)] for x in range(i, i + self.batch_size)] for i in range(0, len(order), self.batch_size)]
 
+        if self.group_method == 'bucket':
+            # complete the last group with the images closest in shape, instead of wrapping around to the first images
+            if len(order) > self.batch_size and len(order) % self.batch_size:
+                self.groups[-1] = order[-self.batch_size:]
+
+            self.padding_fraction = self.compute_padding_fraction(self.resized_shapes)
+
+    def round_to_stride(self, shape):
+        """ Round a (height, width) shape up to a multiple of bucket_stride.
+        """
+        if not self.bucket_stride:
+            return tuple(shape)
+        return tuple(-(-size // self.bucket_stride) * self.bucket_stride for size in shape)
+
+    def compute_batch_shape(self, image_group):
+        """ Compute the (height, width, channels) of the batch the images in image_group are padded to.
+        """
+        max_shape = tuple(max(image.shape[x] for image in image_group) for x in range(3))
+        return self.round_to_stride(max_shape[:2]) + max_shape[2:]
+
+    def compute_padding_fraction(self, shapes):
+        """ Compute the fraction of the pixels in all batches of an epoch that are padding.
+
+        The image shapes after resizing are known up front, augmentation does not change them.
+
+        Args
+            shapes: The (height, width) of every image after resizing, indexed by image index.
+        """
+        padded = 0
+        total  = 0
+        for group in self.groups:
+            group_shapes = [shapes[image_index] for image_index in group]
+            height, width = self.round_to_stride((max(h for h, _ in group_shapes), max(w for _, w in group_shapes)))
+            total  += self.batch_size * height * width
+            padded += self.batch_size * height * width - sum(h * w for h, w in group_shapes)
+
+        return float(padded) / total if total else 0.0
+
     def compute_inputs(self, image_group):
         """ Compute inputs for the network using an image_group.
         """
-        # get the max image shape
-        max_shape = tuple(max(image.shape[x] for image in image_group) for x in range(3))
+        # get the shape of the batch
+        max_shape = self.compute_batch_shape(image_group)
+
+        if self.batch_buffers is not None:
+            return self.compute_inputs_pooled(image_group, max_shape)
 
         # construct an image batch object
-        image_batch = np.zeros((self.batch_size,) + max_shape, dtype=keras.backend.floatx())
+        image_batch = np.zeros((self.batch_size,) + max_shape, dtype=self.input_dtype())
 
         # copy all images to the upper left part of the image batch object
         for image_index, image in enumerate(image_group):
@@ -314,36 +688,81 @@ class Generator(keras.utils.Sequence):
         if keras.backend.image_data_format() == 'channels_first':
             image_batch = image_batch.transpose((0, 3, 1, 2))
 
-        return tf.constant(image_batch, dtype = tf.float32)
+        return image_batch
+
+    def compute_inputs_pooled(self, image_group, max_shape):
+        """ Compute inputs for the network in a reused buffer from the batch buffer pool.
+
+        Only the padding around each image is cleared, and images are copied straight into
+        the layout expected by the network, so no transpose is needed for 'channels_first'.
+        """
+        channels_first = keras.backend.image_data_format() == 'channels_first'
+        height, width, channels = max_shape
+
+        if channels_first:
+            batch_shape = (self.batch_size, channels, height, width)
+        else:
+            batch_shape = (self.batch_size, height, width, channels)
+        image_batch = self.batch_buffers.get(batch_shape, self.input_dtype())
+
+        for image_index in range(self.batch_size):
+            if image_index >= len(image_group):
+                image_batch[image_index] = 0
+                continue
+
+            image = image_group[image_index]
+            slot  = image_batch[image_index]
+            h, w, c = image.shape
+
+            if channels_first:
+                slot[:c, :h, :w] = image.transpose((2, 0, 1))
+                slot[c:] = 0
+                slot[:, h:, :] = 0
+                slot[:, :h, w:] = 0
+            else:
+                slot[:h, :w, :c] = image
+                slot[:h, :w, c:] = 0
+                slot[h:] = 0
+                slot[:h, w:] = 0
+
+        return image_batch
 
     def generate_anchors(self, image_shape):
-        anchor_params = None
-        if self.config and 'anchor_parameters' in self.config:
-            anchor_params = parse_anchor_parameters(self.config)
-        return anchors_for_shape(image_shape, anchor_params=anchor_params, shapes_callback=self.compute_shapes)
+        """ Returns the anchors for image_shape, memoized per shape since batches tend to reuse a few shapes.
+        """
+        return cached_anchors_for_shape(image_shape, anchor_params=self.anchor_params, shapes_callback=self.compute_shapes)
 
     def compute_targets(self, image_group, annotations_group):
         """ Compute target outputs for the network using images and their annotations.
         """
-        # get the max image shape
-        max_shape = tuple(max(image.shape[x] for image in image_group) for x in range(3))
+        # get the shape of the batch
+        max_shape = self.compute_batch_shape(image_group)
         anchors   = self.generate_anchors(max_shape)
 
         batches = self.compute_anchor_targets(
             anchors,
             image_group,
             annotations_group,
-            self.num_classes()
+            self.num_classes(),
+            num_threads=self.num_overlap_threads
         )
 
-        return list(batches)
+        return [np.asarray(batch) for batch in batches]
 
     def compute_input_output(self, group):
         """ Compute inputs and target outputs for the network.
+
+        Only numpy arrays are produced here, so this can safely run in worker processes.
+        Conversion to tensors happens in __getitem__.
         """
         # load images and annotations
-        image_group       = self.load_image_group(group)
-        annotations_group = self.load_annotations_group(group)
+        image_group, scale_group = self.load_scaled_image_group(group)
+        annotations_group        = self.load_annotations_group(group)
+
+        # bring the annotations to the scale of images that were loaded resized
+        for annotations, scale in zip(annotations_group, scale_group):
+            if scale != 1:
+                annotations['bboxes'] = annotations['bboxes'] * scale
 
         # check validity of annotations
         image_group, annotations_group = self.filter_annotations(image_group, annotations_group, group)
@@ -351,11 +770,8 @@ class Generator(keras.utils.Sequence):
         # randomly apply visual effect
         image_group, annotations_group = self.random_visual_effect_group(image_group, annotations_group)
 
-        # randomly transform data
-        image_group, annotations_group = self.random_transform_group(image_group, annotations_group)
-
-        # perform preprocessing steps
-        image_group, annotations_group = self.preprocess_group(image_group, annotations_group)
+        # randomly transform data and perform preprocessing steps
+        image_group, annotations_group = self.transform_preprocess_group(image_group, annotations_group)
 
         # compute network inputs
         inputs = self.compute_inputs(image_group)
@@ -365,6 +781,14 @@ class Generator(keras.utils.Sequence):
 
         return inputs, targets
 
+    def to_tf_dataset(self, **kwargs):
+        """ Create a tf.data.Dataset producing the same batches as this generator.
+
+        See object_detection_retinanet.preprocessing.tf_dataset.to_tf_dataset for the arguments.
+        """
+        from object_detection_retinanet.preprocessing.tf_dataset import to_tf_dataset
+        return to_tf_dataset(self, **kwargs)
+
     def __len__(self):
         """
         Number of batches for generator.
@@ -379,4 +803,8 @@ class Generator(keras.utils.Sequence):
         group = self.groups[index]
         inputs, targets = self.compute_input_output(group)
 
+        # pooled buffers are handed to keras as they are, avoiding another copy of the batch
+        if self.batch_buffers is None:
+            inputs = tf.constant(inputs, dtype=tf.uint8 if self.uint8_inputs else tf.float32)
+
         return inputs, targets
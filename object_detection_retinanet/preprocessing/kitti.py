@@ -17,11 +17,8 @@ limitations under the License.
 import csv
 import os.path
 
-import numpy as np
-from PIL import Image
-
+from .annotation_store import AnnotationStoreBuilder
 from .generator import Generator
-from ..utils.image import read_image_bgr
 
 kitti_classes = {
     'Car': 0,
@@ -81,7 +78,7 @@ class KittiGenerator(Generator):
         for name, label in self.classes.items():
             self.labels[label] = name
 
-        self.image_data = dict()
+        annotations = AnnotationStoreBuilder()
         self.images = []
         for i, fn in enumerate(os.listdir(label_dir)):
             label_fp = os.path.join(label_dir, fn)
@@ -93,15 +90,18 @@ class KittiGenerator(Generator):
                           'lx', 'ly', 'lz', 'ry']
             with open(label_fp, 'r') as csv_file:
                 reader = csv.DictReader(csv_file, delimiter=' ', fieldnames=fieldnames)
-                boxes = []
+                boxes  = []
+                labels = []
                 for line, row in enumerate(reader):
                     label = row['type']
                     cls_id = kitti_classes[label]
 
-                    annotation = {'cls_id': cls_id, 'x1': row['left'], 'x2': row['right'], 'y2': row['bottom'], 'y1': row['top']}
-                    boxes.append(annotation)
+                    boxes.append((float(row['left']), float(row['top']), float(row['right']), float(row['bottom'])))
+                    labels.append(cls_id)
+
+                annotations.add_image(boxes, labels)
 
-                self.image_data[i] = boxes
+        self.annotation_store = annotations.build()
 
         super(KittiGenerator, self).__init__(**kwargs)
 
@@ -135,29 +135,7 @@ class KittiGenerator(Generator):
         """
         return self.labels[label]
 
-    def image_aspect_ratio(self, image_index):
-        """ Compute the aspect ratio for an image with image_index.
-        """
-        # PIL is fast for metadata
-        image = Image.open(self.images[image_index])
-        return float(image.width) / float(image.height)
-
-    def load_image(self, image_index):
-        """ Load an image at the image_index.
+    def image_path(self, image_index):
+        """ Returns the image path for image_index.
         """
-        return read_image_bgr(self.images[image_index])
-
-    def load_annotations(self, image_index):
-        """ Load annotations for an image_index.
-        """
-        image_data = self.image_data[image_index]
-        annotations = {'labels': np.empty((len(image_data),)), 'bboxes': np.empty((len(image_data), 4))}
-
-        for idx, ann in enumerate(image_data):
-            annotations['bboxes'][idx, 0] = float(ann['x1'])
-            annotations['bboxes'][idx, 1] = float(ann['y1'])
-            annotations['bboxes'][idx, 2] = float(ann['x2'])
-            annotations['bboxes'][idx, 3] = float(ann['y2'])
-            annotations['labels'][idx] = int(ann['cls_id'])
-
-        return annotations
+        return self.images[image_index]
@@ -22,8 +22,8 @@ import warnings
 import numpy as np
 from PIL import Image
 
+from .annotation_store import AnnotationStoreBuilder
 from .generator import Generator
-from ..utils.image import read_image_bgr
 
 
 def load_hierarchy(metadata_dir, version='v4'):
@@ -251,6 +251,22 @@ class OpenImagesGenerator(Generator):
 
         self.id_to_image_id = dict([(i, k) for i, k in enumerate(self.annotations)])
 
+        # move the annotations from the (large) json structure to an annotation store, in pixel coordinates
+        self.image_dimensions = np.zeros((len(self.id_to_image_id), 2), dtype=np.int32)
+        annotations = AnnotationStoreBuilder()
+        for i in range(len(self.id_to_image_id)):
+            image_annotations = self.annotations[self.id_to_image_id[i]]
+            width, height     = image_annotations['w'], image_annotations['h']
+
+            self.image_dimensions[i] = width, height
+            annotations.add_image(
+                [(ann['x1'] * width, ann['y1'] * height, ann['x2'] * width, ann['y2'] * height) for ann in image_annotations['boxes']],
+                [ann['cls_id'] for ann in image_annotations['boxes']]
+            )
+
+        self.annotation_store = annotations.build()
+        del self.annotations
+
         super(OpenImagesGenerator, self).__init__(**kwargs)
 
     def __filter_data(self, id_to_labels, cls_index, labels_filter=None, parent_label=None):
@@ -319,7 +335,7 @@ class OpenImagesGenerator(Generator):
         return children_id_to_labels, filtered_annotations
 
     def size(self):
-        return len(self.annotations)
+        return len(self.id_to_image_id)
 
     def num_classes(self):
         return len(self.id_to_labels)
@@ -340,36 +356,10 @@ class OpenImagesGenerator(Generator):
     def label_to_name(self, label):
         return self.id_to_labels[label]
 
-    def image_aspect_ratio(self, image_index):
-        img_annotations = self.annotations[self.id_to_image_id[image_index]]
-        height, width = img_annotations['h'], img_annotations['w']
-        return float(width) / float(height)
+    def image_size(self, image_index):
+        width, height = self.image_dimensions[image_index]
+        return int(width), int(height)
 
     def image_path(self, image_index):
         path = os.path.join(self.base_dir, self.id_to_image_id[image_index] + '.jpg')
         return path
-
-    def load_image(self, image_index):
-        return read_image_bgr(self.image_path(image_index))
-
-    def load_annotations(self, image_index):
-        image_annotations = self.annotations[self.id_to_image_id[image_index]]
-
-        labels = image_annotations['boxes']
-        height, width = image_annotations['h'], image_annotations['w']
-
-        annotations = {'labels': np.empty((len(labels),)), 'bboxes': np.empty((len(labels), 4))}
-        for idx, ann in enumerate(labels):
-            cls_id = ann['cls_id']
-            x1 = ann['x1'] * width
-            x2 = ann['x2'] * width
-            y1 = ann['y1'] * height
-            y2 = ann['y2'] * height
-
-            annotations['bboxes'][idx, 0] = x1
-            annotations['bboxes'][idx, 1] = y1
-            annotations['bboxes'][idx, 2] = x2
-            annotations['bboxes'][idx, 3] = y2
-            annotations['labels'][idx] = cls_id
-
-        return annotations
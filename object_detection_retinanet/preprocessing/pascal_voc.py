@@ -14,13 +14,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from ..preprocessing.annotation_store import AnnotationStoreBuilder
 from ..preprocessing.generator import Generator
-from ..utils.image import read_image_bgr
 
 import os
 import numpy as np
 from six import raise_from
-from PIL import Image
 
 try:
     import xml.etree.cElementTree as ET
@@ -100,6 +99,13 @@ class PascalVocGenerator(Generator):
         for key, value in self.classes.items():
             self.labels[value] = key
 
+        # parse all annotation files once
+        annotations = AnnotationStoreBuilder()
+        for image_name in self.image_names:
+            boxes, labels = self.__load_annotation_file(image_name)
+            annotations.add_image(boxes, labels)
+        self.annotation_store = annotations.build()
+
         super(PascalVocGenerator, self).__init__(**kwargs)
 
     def size(self):
@@ -132,18 +138,10 @@ class PascalVocGenerator(Generator):
         """
         return self.labels[label]
 
-    def image_aspect_ratio(self, image_index):
-        """ Compute the aspect ratio for an image with image_index.
-        """
-        path  = os.path.join(self.data_dir, 'JPEGImages', self.image_names[image_index] + self.image_extension)
-        image = Image.open(path)
-        return float(image.width) / float(image.height)
-
-    def load_image(self, image_index):
-        """ Load an image at the image_index.
+    def image_path(self, image_index):
+        """ Returns the image path for image_index.
         """
-        path = os.path.join(self.data_dir, 'JPEGImages', self.image_names[image_index] + self.image_extension)
-        return read_image_bgr(path)
+        return os.path.join(self.data_dir, 'JPEGImages', self.image_names[image_index] + self.image_extension)
 
     def __parse_annotation(self, element):
         """ Parse an annotation given an XML element.
@@ -168,8 +166,12 @@ class PascalVocGenerator(Generator):
 
     def __parse_annotations(self, xml_root):
         """ Parse all annotations under the xml_root.
+
+        Returns
+            A list of boxes and a list of their labels, without the skipped (truncated or difficult) objects.
         """
-        annotations = {'labels': np.empty((len(xml_root.findall('object')),)), 'bboxes': np.empty((len(xml_root.findall('object')), 4))}
+        boxes  = []
+        labels = []
         for i, element in enumerate(xml_root.iter('object')):
             try:
                 truncated, difficult, box, label = self.__parse_annotation(element)
@@ -181,15 +183,15 @@ class PascalVocGenerator(Generator):
             if difficult and self.skip_difficult:
                 continue
 
-            annotations['bboxes'][i, :] = box
-            annotations['labels'][i] = label
+            boxes.append(box)
+            labels.append(label)
 
-        return annotations
+        return boxes, labels
 
-    def load_annotations(self, image_index):
-        """ Load annotations for an image_index.
+    def __load_annotation_file(self, image_name):
+        """ Load the annotations of an image from its XML file.
         """
-        filename = self.image_names[image_index] + '.xml'
+        filename = image_name + '.xml'
         try:
             tree = ET.parse(os.path.join(self.data_dir, 'Annotations', filename))
             return self.__parse_annotations(tree.getroot())
@@ -0,0 +1,261 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import warnings
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import keras
+
+# from ..utils.cache import ImageCache
+from object_detection_retinanet.utils.cache import ImageCache
+
+
+# State of a prefetch worker process, set by _init_worker.
+_worker_generator  = None
+_worker_shared_dir = None
+
+
+def _default_shared_dir():
+    """ Returns a directory backed by shared memory if available, otherwise the default temporary directory.
+    """
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def _init_worker(generator, shared_dir, num_overlap_threads, num_workers):
+    """ Initialize a prefetch worker process.
+
+    The forked generator is reset first, threads and locks of the parent don't carry over to the worker.
+
+    Unless the generator limits them itself, the overlap threads of a worker are limited to its share of the cores,
+    so the workers together don't run more OpenMP threads than there are cores.
+    Every worker has its own image cache, so the image_cache_bytes budget of the generator is split across the workers.
+    """
+    global _worker_generator, _worker_shared_dir
+    _worker_generator  = generator
+    _worker_shared_dir = shared_dir
+    _worker_generator.after_fork()
+
+    if _worker_generator.image_cache is not None:
+        _worker_generator.image_cache = ImageCache(_worker_generator.image_cache.max_bytes // num_workers)
+
+    if _worker_generator.num_overlap_threads <= 0:
+        _worker_generator.num_overlap_threads = num_overlap_threads
+
+
+def _share_array(array):
+    """ Write an array to a file in shared memory and return the path of that file.
+    """
+    array = np.asarray(array)
+    fd, path = tempfile.mkstemp(prefix='retinanet-batch-', suffix='.npy', dir=_worker_shared_dir)
+    os.close(fd)
+
+    shared = np.lib.format.open_memmap(path, mode='w+', dtype=array.dtype, shape=array.shape)
+    shared[...] = array
+    del shared
+
+    return path
+
+
+def _receive_array(path):
+    """ Map an array written by _share_array into memory.
+
+    The file is unlinked right away, the mapping stays valid until the array is garbage collected.
+    """
+    try:
+        return np.load(path, mmap_mode='r')
+    finally:
+        os.unlink(path)
+
+
+def _discard_array(path):
+    """ Remove an array written by _share_array without reading it.
+    """
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _shutdown(pool, shared_dir):
+    """ Stop the worker processes and remove the directory with the arrays they wrote, including unconsumed batches.
+    """
+    pool.terminate()
+    pool.join()
+    shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+def _compute_group(group, seed):
+    """ Compute inputs and targets for a group in a worker process.
+
+    The augmentations are reseeded for every batch, otherwise every forked worker would draw the same random augmentations.
+
+    Returns
+        The shared memory paths of the inputs and of each target.
+    """
+    _worker_generator.reseed_augmentation(seed)
+    inputs, targets = _worker_generator.compute_input_output(group)
+    return _share_array(inputs), [_share_array(target) for target in targets]
+
+
+class PrefetchGenerator(keras.utils.Sequence):
+    """ Computes the batches of a generator ahead of time in a pool of worker processes.
+
+    The workers run Generator.compute_input_output and hand the resulting arrays back through files in shared memory,
+    so batches are never pickled. The returned arrays are read-only memory maps of those files.
+
+    Every batch is computed with augmentations seeded from (seed, epoch, batch index), see Generator.reseed_augmentation,
+    so workers don't repeat each others augmentations and a run with a fixed seed is reproducible.
+
+    Batches after the requested one are computed ahead, assuming batches are requested in order. Pass shuffle=False
+    to fit_generator, the order of the groups is shuffled by the generator itself at the end of every epoch.
+    When batches are requested out of order, only the requested batches are computed.
+
+    The worker processes and their files are cleaned up by close, or else when the PrefetchGenerator is garbage collected
+    or the interpreter exits.
+    """
+
+    def __init__(
+        self,
+        generator,
+        workers=None,
+        max_queue_size=None,
+        shared_dir=None,
+        seed=None,
+    ):
+        """ Initialize a PrefetchGenerator.
+
+        Args
+            generator      : The Generator to compute batches for.
+            workers        : Number of worker processes (defaults to the number of CPUs).
+            max_queue_size : Maximum number of batches that are computed ahead (defaults to twice the number of workers).
+            shared_dir     : Directory used to hand arrays to the training process (defaults to /dev/shm if it exists).
+            seed           : Seed for the augmentations of the batches (defaults to a random seed).
+        """
+        self.generator      = generator
+        self.workers        = workers or multiprocessing.cpu_count()
+        self.max_queue_size = max_queue_size or 2 * self.workers
+        self.shared_dir     = shared_dir or _default_shared_dir()
+        self.seed           = seed if seed is not None else random.randrange(2 ** 31)
+
+        self._epoch      = 0
+        self._pool       = None
+        self._finalizer  = None
+        self._pending    = OrderedDict()
+        self._lock       = threading.Lock()
+        self._last_index = None
+        self._warned     = False
+
+    def pool(self):
+        """ Returns the pool of worker processes, creating it on first use.
+        """
+        if self._pool is None:
+            # the workers write to a private directory, so everything they leave behind can be removed at once
+            worker_dir = tempfile.mkdtemp(prefix='retinanet-prefetch-', dir=self.shared_dir)
+            self._pool = multiprocessing.Pool(
+                self.workers,
+                initializer=_init_worker,
+                initargs=(self.generator, worker_dir, max(1, multiprocessing.cpu_count() // self.workers), self.workers)
+            )
+            self._finalizer = weakref.finalize(self, _shutdown, self._pool, worker_dir)
+        return self._pool
+
+    def _schedule(self, index):
+        """ Start computing the batch with the given index, unless it is already pending.
+        """
+        if index not in self._pending:
+            group = self.generator.groups[index]
+            seed  = [self.seed, self._epoch, index]
+            self._pending[index] = self.pool().apply_async(_compute_group, (group, seed))
+
+    def _discard_pending(self):
+        """ Wait for all pending batches and discard their results.
+        """
+        with self._lock:
+            pending       = list(self._pending.values())
+            self._pending = OrderedDict()
+
+        for result in pending:
+            try:
+                inputs, targets = result.get()
+            except Exception:
+                continue
+            for path in [inputs] + targets:
+                _discard_array(path)
+
+    def on_epoch_end(self):
+        # batches computed ahead belong to the old order of the groups
+        self._discard_pending()
+        self._epoch += 1
+        self.generator.on_epoch_end()
+
+    def close(self):
+        """ Discard pending batches and stop the worker processes.
+        """
+        if self._pool is None:
+            return
+
+        self._discard_pending()
+        self._pool.close()
+        self._pool.join()
+        self._finalizer()
+        self._pool      = None
+        self._finalizer = None
+
+    def __len__(self):
+        """
+        Number of batches for generator.
+        """
+        return len(self.generator)
+
+    def __getitem__(self, index):
+        """
+        Keras sequence method for generating batches.
+        """
+        with self._lock:
+            self._schedule(index)
+
+            # keras threads may request batches slightly out of order, but a jump further than the queue means
+            # the batches are requested in shuffled order and computing the next batches ahead would be wasted work
+            in_order = index == 0 or self._last_index is None or abs(index - self._last_index) <= self.max_queue_size
+            self._last_index = index
+
+            if in_order:
+                # keep the next batches in flight, up to max_queue_size
+                ahead = index + 1
+                while len(self._pending) < self.max_queue_size and ahead < len(self):
+                    self._schedule(ahead)
+                    ahead += 1
+            elif not self._warned:
+                self._warned = True
+                warnings.warn(
+                    'Batches are requested out of order, so they are not computed ahead. '
+                    'Pass shuffle=False to fit_generator, the generator shuffles its groups itself.'
+                )
+
+            result = self._pending.pop(index)
+
+        inputs, targets = result.get()
+        return _receive_array(inputs), [_receive_array(target) for target in targets]
@@ -0,0 +1,263 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import json
+import os
+
+import numpy as np
+
+#from .annotation_store import AnnotationStore
+#from .generator import Generator
+from object_detection_retinanet.preprocessing.annotation_store import AnnotationStore
+from object_detection_retinanet.preprocessing.generator import Generator
+
+
+def _read_image_file(generator, image_index):
+    """ Returns the encoded image with image_index, without decoding it.
+    """
+    image_file = generator.image_file(image_index)
+    if hasattr(image_file, 'read'):
+        return image_file.read()
+
+    with open(image_file, 'rb') as f:
+        return f.read()
+
+
+def _shard_name(index):
+    return 'shard-{:05d}'.format(index)
+
+
+def _write_shard_index(path, entries):
+    """ Write the index of a shard.
+
+    Args
+        path    : Path of the index file.
+        entries : List of (name, image size in bytes, (width, height), annotations) tuples, in the order the images were written.
+    """
+    offsets            = np.zeros((len(entries) + 1,), dtype=np.int64)
+    annotation_offsets = np.zeros((len(entries) + 1,), dtype=np.int64)
+    offsets[1:]            = np.cumsum([entry[1] for entry in entries])
+    annotation_offsets[1:] = np.cumsum([len(entry[3]['labels']) for entry in entries])
+
+    # the names are stored as one utf-8 blob with offsets, a fixed-width array would pad every name to the longest one
+    names        = [entry[0].encode('utf-8') for entry in entries]
+    name_offsets = np.zeros((len(entries) + 1,), dtype=np.int64)
+    name_offsets[1:] = np.cumsum([len(name) for name in names])
+
+    bboxes = [np.asarray(entry[3]['bboxes'], dtype=np.float64).reshape((-1, 4)) for entry in entries]
+    labels = [np.asarray(entry[3]['labels']).reshape((-1,)) for entry in entries]
+
+    with open(path, 'wb') as f:
+        np.savez(
+            f,
+            name_data=np.frombuffer(b''.join(names), dtype=np.uint8),
+            name_offsets=name_offsets,
+            offsets=offsets,
+            sizes=np.array([entry[2] for entry in entries], dtype=np.int32).reshape((-1, 2)),
+            annotation_offsets=annotation_offsets,
+            bboxes=np.concatenate(bboxes) if bboxes else np.zeros((0, 4)),
+            labels=np.concatenate(labels).astype(np.int32) if labels else np.zeros((0,), dtype=np.int32),
+        )
+
+
+def pack_shards(generator, output_dir, shard_bytes=1 << 30):
+    """ Pack the images and annotations of a generator into a few large shard files, to be read with a ShardGenerator.
+
+    The encoded image files are copied as they are, they are not decoded.
+    Every shard is a file of concatenated image files, with an index file holding the offsets of the images,
+    their sizes and their packed boxes and labels.
+
+    Args
+        generator   : The generator to pack, for example a CSVGenerator or a CocoGenerator.
+        output_dir  : Directory to write the shards to.
+        shard_bytes : Images are added to a shard until it holds at least this many bytes.
+
+    Returns
+        The number of shards that were written.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # the metadata is written last, an interrupted pack is never considered valid
+    meta_path = os.path.join(output_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    shards  = []
+    entries = []
+    data    = None
+
+    def finish_shard():
+        data.close()
+        _write_shard_index(os.path.join(output_dir, _shard_name(len(shards)) + '.npz'), entries)
+        shards.append({'name': _shard_name(len(shards)), 'images': len(entries), 'bytes': int(sum(entry[1] for entry in entries))})
+
+    # read the image files in chunks with the io workers of the generator
+    chunk_size = 4 * generator.num_io_workers
+    for start in range(0, generator.size(), chunk_size):
+        chunk    = range(start, min(start + chunk_size, generator.size()))
+        contents = generator._map_group(lambda image_index: _read_image_file(generator, image_index), chunk)
+
+        for image_index, content in zip(chunk, contents):
+            if data is None:
+                data    = open(os.path.join(output_dir, _shard_name(len(shards)) + '.data'), 'wb')
+                entries = []
+
+            data.write(content)
+            entries.append((
+                generator.image_path(image_index),
+                len(content),
+                generator.image_size(image_index),
+                generator.load_annotations(image_index),
+            ))
+
+            if data.tell() >= shard_bytes:
+                finish_shard()
+                data = None
+
+    if data is not None:
+        finish_shard()
+
+    labels = [label for label in range(generator.num_classes()) if generator.has_label(label)]
+    with open(meta_path, 'w') as f:
+        json.dump({
+            'shards'  : shards,
+            'classes' : [[generator.label_to_name(label), label] for label in labels],
+        }, f)
+
+    return len(shards)
+
+
+class ShardGenerator(Generator):
+    """ Generate data from a dataset packed with pack_shards.
+
+    The shards are memory-mapped, so an image is read with a single slice of a large file instead of opening a file per image.
+    """
+
+    def __init__(
+        self,
+        shard_dir,
+        **kwargs
+    ):
+        """ Initialize a shard data generator.
+
+        Args
+            shard_dir: Directory containing the shards written by pack_shards.
+        """
+        self.shard_dir = shard_dir
+
+        with open(os.path.join(self.shard_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        self.classes = dict((name, label) for name, label in meta['classes'])
+        self.labels  = dict((label, name) for name, label in meta['classes'])
+
+        # concatenate the indices of the shards, the offsets of an image stay relative to its shard
+        self.shard_names = [shard['name'] for shard in meta['shards']]
+        name_data, name_offsets, offsets, sizes, annotation_offsets, bboxes, labels, image_shards = [], [], [], [], [], [], [], []
+        name_count       = 0
+        annotation_count = 0
+        for shard_index, shard_name in enumerate(self.shard_names):
+            with np.load(os.path.join(self.shard_dir, shard_name + '.npz')) as index:
+                name_data.append(index['name_data'])
+                name_offsets.append(index['name_offsets'][:-1] + name_count)
+                offsets.append(np.stack([index['offsets'][:-1], index['offsets'][1:]], axis=1))
+                sizes.append(index['sizes'])
+                annotation_offsets.append(index['annotation_offsets'][:-1] + annotation_count)
+                bboxes.append(index['bboxes'])
+                labels.append(index['labels'])
+                image_shards.append(np.full((len(index['sizes']),), shard_index, dtype=np.int32))
+                name_count       += len(index['name_data'])
+                annotation_count += len(index['labels'])
+
+        self.image_name_data    = np.concatenate(name_data) if name_data else np.zeros((0,), dtype=np.uint8)
+        self.image_name_offsets = np.append(np.concatenate(name_offsets) if name_offsets else [], name_count).astype(np.int64)
+        self.image_offsets      = np.concatenate(offsets) if offsets else np.zeros((0, 2), dtype=np.int64)
+        self.image_shapes       = np.concatenate(sizes) if sizes else np.zeros((0, 2), dtype=np.int32)
+        self.image_shards       = np.concatenate(image_shards) if image_shards else np.zeros((0,), dtype=np.int32)
+
+        self.annotation_store = AnnotationStore(
+            np.append(np.concatenate(annotation_offsets) if annotation_offsets else [], annotation_count),
+            np.concatenate(bboxes) if bboxes else np.zeros((0, 4)),
+            np.concatenate(labels) if labels else np.zeros((0,), dtype=np.int32),
+        )
+
+        # memory maps of the shards, opened on first use (also after pickling)
+        self._shard_data = {}
+
+        super(ShardGenerator, self).__init__(**kwargs)
+
+    def size(self):
+        """ Size of the dataset.
+        """
+        return len(self.image_shapes)
+
+    def num_classes(self):
+        """ Number of classes in the dataset.
+        """
+        return max(self.classes.values()) + 1
+
+    def has_label(self, label):
+        """ Return True if label is a known label.
+        """
+        return label in self.labels
+
+    def has_name(self, name):
+        """ Returns True if name is a known class.
+        """
+        return name in self.classes
+
+    def name_to_label(self, name):
+        """ Map name to label.
+        """
+        return self.classes[name]
+
+    def label_to_name(self, label):
+        """ Map label to name.
+        """
+        return self.labels[label]
+
+    def image_path(self, image_index):
+        """ Returns the path the image had when it was packed, the image itself is read from its shard.
+        """
+        start, end = self.image_name_offsets[image_index:image_index + 2]
+        return self.image_name_data[start:end].tobytes().decode('utf-8')
+
+    def image_size(self, image_index):
+        """ Returns the (width, height) of the image with image_index, from the index of the shard.
+        """
+        width, height = self.image_shapes[image_index]
+        return int(width), int(height)
+
+    def image_file(self, image_index):
+        """ Returns a file-like object with the encoded image with image_index.
+        """
+        shard_index = int(self.image_shards[image_index])
+        data = self._shard_data.get(shard_index)
+        if data is None:
+            path = os.path.join(self.shard_dir, self.shard_names[shard_index] + '.data')
+            data = self._shard_data[shard_index] = np.memmap(path, dtype=np.uint8, mode='r')
+
+        start, end = self.image_offsets[image_index]
+        return io.BytesIO(data[start:end])
+
+    def __getstate__(self):
+        """ Pickle without the memory maps of the shards, they are reopened on first use.
+        """
+        state = super(ShardGenerator, self).__getstate__()
+        state['_shard_data'] = {}
+        return state
@@ -0,0 +1,189 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import tensorflow as tf
+import keras
+
+
+def _load_entry(generator, image_index):
+    """ Load a single image and its filtered annotations, at the scale it was loaded with.
+    """
+    image_index = int(image_index)
+    image, scale = generator.load_scaled_image(image_index)
+    annotations  = generator.load_annotations_group([image_index])[0]
+
+    if scale != 1:
+        annotations['bboxes'] = annotations['bboxes'] * scale
+
+    image_group, annotations_group = generator.filter_annotations([image], [annotations], [image_index])
+    annotations = annotations_group[0]
+
+    return (
+        np.ascontiguousarray(image_group[0]),
+        np.asarray(annotations['bboxes'], dtype=np.float64).reshape((-1, 4)),
+        np.asarray(annotations['labels'], dtype=np.float64).reshape((-1,)),
+    )
+
+
+def _augment_entry(generator, image, bboxes, labels):
+    """ Apply the random visual effect, random transform and preprocessing of the generator to a single image.
+    """
+    # tensors converted to numpy can share memory with the (cached) dataset, never modify them in place
+    image_group       = [np.array(image)]
+    annotations_group = [{'bboxes': np.array(bboxes), 'labels': np.array(labels)}]
+
+    image_group, annotations_group = generator.random_visual_effect_group(image_group, annotations_group)
+    image_group, annotations_group = generator.transform_preprocess_group(image_group, annotations_group)
+
+    image       = image_group[0]
+    annotations = annotations_group[0]
+    return (
+        image.astype(generator.input_dtype(), copy=False),
+        np.asarray(annotations['bboxes'], dtype=np.float64).reshape((-1, 4)),
+        np.asarray(annotations['labels'], dtype=np.float64).reshape((-1,)),
+        np.asarray(image.shape, dtype=np.int32),
+    )
+
+
+def _batch_targets(generator, bboxes, labels, shapes):
+    """ Compute the targets for a padded batch, exactly like Generator.compute_targets.
+
+    Annotations are padded with a label of -1, the images are only needed for their shape.
+    """
+    image_group       = []
+    annotations_group = []
+    for image_bboxes, image_labels, shape in zip(bboxes.numpy(), labels.numpy(), shapes.numpy()):
+        valid = image_labels >= 0
+        image_group.append(np.broadcast_to(np.zeros((), dtype=np.uint8), tuple(shape)))
+        annotations_group.append({'bboxes': image_bboxes[valid], 'labels': image_labels[valid]})
+
+    return [target.astype(np.float32, copy=False) for target in generator.compute_targets(image_group, annotations_group)]
+
+
+def to_tf_dataset(
+    generator,
+    num_parallel_calls=tf.data.experimental.AUTOTUNE,
+    prefetch=tf.data.experimental.AUTOTUNE,
+    cache=None,
+    snapshot=None,
+    shuffle=False,
+):
+    """ Create a tf.data.Dataset that produces the same batches as a Generator.
+
+    Images are loaded and augmented per image in parallel map calls on the tf.data thread pool,
+    then padded into batches with the same shape rules as Generator.compute_inputs,
+    and targets are computed per batch with Generator.compute_targets.
+    Batches are formed from the current Generator.groups, so grouping by aspect ratio is preserved.
+
+    Args
+        generator          : The Generator to create a dataset for.
+        num_parallel_calls : Number of images loaded and augmented in parallel (defaults to autotuning).
+        prefetch           : Number of batches to prefetch, None to disable (defaults to autotuning).
+        cache              : Cache the loaded images before augmentation. True caches in memory, a string caches in that file.
+        snapshot           : Directory to store a tf.data snapshot of the loaded images in, an alternative to cache.
+        shuffle            : Reshuffle the order of the groups every iteration, can't be combined with cache or snapshot.
+
+    Returns
+        A tf.data.Dataset of (inputs, [regression targets, classification targets]).
+    """
+    # a cache or snapshot replays the images in the order of its first iteration, so every epoch would repeat the first shuffle
+    if shuffle and (cache or snapshot is not None):
+        raise ValueError('shuffle can\'t be combined with cache or snapshot, they replay the order of the first iteration.')
+
+    batch_size = generator.batch_size
+    groups     = np.asarray(generator.groups, dtype=np.int64)
+
+    dataset = tf.data.Dataset.from_tensor_slices(groups)
+    if shuffle:
+        dataset = dataset.shuffle(len(groups), reshuffle_each_iteration=True)
+
+    # one element per image, in the order of the groups
+    dataset = dataset.unbatch()
+
+    def load(image_index):
+        image, bboxes, labels = tf.py_function(
+            lambda i: _load_entry(generator, i.numpy()),
+            [image_index],
+            [tf.uint8, tf.float64, tf.float64]
+        )
+        image.set_shape([None, None, 3])
+        bboxes.set_shape([None, 4])
+        labels.set_shape([None])
+        return image, bboxes, labels
+
+    dataset = dataset.map(load, num_parallel_calls=num_parallel_calls)
+
+    if snapshot is not None:
+        dataset = dataset.apply(tf.data.experimental.snapshot(snapshot))
+    elif cache:
+        dataset = dataset.cache('' if cache is True else cache)
+
+    def augment(image, bboxes, labels):
+        image, bboxes, labels, shape = tf.py_function(
+            lambda *args: _augment_entry(generator, *[arg.numpy() for arg in args]),
+            [image, bboxes, labels],
+            [generator.input_dtype(), tf.float64, tf.float64, tf.int32]
+        )
+        image.set_shape([None, None, 3])
+        bboxes.set_shape([None, 4])
+        labels.set_shape([None])
+        shape.set_shape([3])
+        return image, bboxes, labels, shape
+
+    dataset = dataset.map(augment, num_parallel_calls=num_parallel_calls)
+
+    # images are padded at the bottom and right with zeros, like compute_inputs does
+    dataset = dataset.padded_batch(
+        batch_size,
+        padded_shapes=([None, None, 3], [None, 4], [None], [3]),
+        padding_values=(
+            tf.constant(0, dtype=generator.input_dtype()),
+            tf.constant(0, dtype=tf.float64),
+            tf.constant(-1, dtype=tf.float64),
+            tf.constant(0, dtype=tf.int32),
+        ),
+        drop_remainder=True,
+    )
+
+    def targets(images, bboxes, labels, shapes):
+        regression, classification = tf.py_function(
+            lambda *args: _batch_targets(generator, *args),
+            [bboxes, labels, shapes],
+            [tf.float32, tf.float32]
+        )
+        regression.set_shape([batch_size, None, 5])
+        # the size of the last axis depends on the target encoding, see anchors.anchor_targets_bbox_sparse
+        classification.set_shape([batch_size, None, None])
+
+        # round the batch shape up to the bucket stride, like Generator.compute_batch_shape
+        if generator.bucket_stride:
+            stride = generator.bucket_stride
+            height = tf.shape(images)[1]
+            width  = tf.shape(images)[2]
+            images = tf.pad(images, [[0, 0], [0, (-height) % stride], [0, (-width) % stride], [0, 0]])
+
+        if keras.backend.image_data_format() == 'channels_first':
+            images = tf.transpose(images, (0, 3, 1, 2))
+
+        return images, (regression, classification)
+
+    dataset = dataset.map(targets, num_parallel_calls=num_parallel_calls)
+
+    if prefetch is not None:
+        dataset = dataset.prefetch(prefetch)
+
+    return dataset
@@ -14,13 +14,19 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import keras
-import tensorflow as tf
-#from ..utils.compute_overlap import compute_overlap
+#from ..utils.compute_overlap import compute_overlap_max, compute_overlap_max_pruned
 import pyximport
 pyximport.install()
-from object_detection_retinanet.utils.compute_overlap import compute_overlap
+from object_detection_retinanet.utils.compute_overlap import compute_overlap_max, compute_overlap_max_pruned
+
+
+# From this number of annotations on, anchors are only compared with the annotations that can overlap them.
+PRUNE_MIN_ANNOTATIONS = 32
 
 
 class AnchorParameters:
@@ -59,7 +65,8 @@ def anchor_targets_bbox(
     annotations_group,
     num_classes,
     negative_overlap=0.4,
-    positive_overlap=0.5
+    positive_overlap=0.5,
+    num_threads=0
 ):
     """ Generate anchor targets for bbox detection.
 
@@ -71,6 +78,7 @@ def anchor_targets_bbox(
         mask_shape: If the image is padded with zeros, mask_shape can be used to mark the relevant part of the image.
         negative_overlap: IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
         positive_overlap: IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+        num_threads: Number of OpenMP threads used to compute the overlaps (0 uses the OpenMP default).
 
     Returns
         labels_batch: batch that contains labels & anchor states (np.array of shape (batch_size, N, num_classes + 1),
@@ -95,7 +103,7 @@ def anchor_targets_bbox(
     for index, (image, annotations) in enumerate(zip(image_group, annotations_group)):
         if annotations['bboxes'].shape[0]:
             # obtain indices of gt annotations with the greatest overlap
-            positive_indices, ignore_indices, argmax_overlaps_inds = compute_gt_annotations(anchors, annotations['bboxes'], negative_overlap, positive_overlap)
+            positive_indices, ignore_indices, argmax_overlaps_inds = compute_gt_annotations(anchors, annotations['bboxes'], negative_overlap, positive_overlap, num_threads)
 
             labels_batch[index, ignore_indices, -1]       = -1
             labels_batch[index, positive_indices, -1]     = 1
@@ -116,14 +124,214 @@ def anchor_targets_bbox(
             labels_batch[index, indices, -1]     = -1
             regression_batch[index, indices, -1] = -1
 
-    return tf.constant(regression_batch, dtype = tf.float32), tf.constant(labels_batch, dtype = tf.float32)
+    return regression_batch, labels_batch
+
+
+def anchor_targets_bbox_batched(
+    anchors,
+    image_group,
+    annotations_group,
+    num_classes,
+    negative_overlap=0.4,
+    positive_overlap=0.5,
+    num_threads=0
+):
+    """ Generate anchor targets for bbox detection for a whole group of images at once.
+
+    Gives the same anchor states and class labels as anchor_targets_bbox, and the same regression targets for positive anchors.
+    Quantities that only depend on the anchors are computed once for the group instead of once per image,
+    and regression targets are only computed for positive anchors, they are left at zero for all other anchors (the loss ignores them).
+
+    Args
+        anchors: np.array of annotations of shape (N, 4) for (x1, y1, x2, y2).
+        image_group: List of BGR images, only their shape is used.
+        annotations_group: List of annotations (np.array of shape (N, 5) for (x1, y1, x2, y2, label)).
+        num_classes: Number of classes to predict.
+        negative_overlap: IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
+        positive_overlap: IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+        num_threads: Number of OpenMP threads used to compute the overlaps (0 uses the OpenMP default).
+
+    Returns
+        regression_batch: np.array of shape (batch_size, N, 4 + 1), see anchor_targets_bbox.
+        labels_batch: np.array of shape (batch_size, N, num_classes + 1), see anchor_targets_bbox.
+    """
+    assert(len(image_group) == len(annotations_group)), "The length of the images and annotations need to be equal."
+    assert(len(annotations_group) > 0), "No data received to compute anchor targets for."
+    for annotations in annotations_group:
+        assert('bboxes' in annotations), "Annotations should contain bboxes."
+        assert('labels' in annotations), "Annotations should contain labels."
+
+    batch_size  = len(image_group)
+    num_anchors = anchors.shape[0]
+
+    regression_batch = np.zeros((batch_size, num_anchors, 4 + 1), dtype=keras.backend.floatx())
+    labels_batch     = np.zeros((batch_size, num_anchors, num_classes + 1), dtype=keras.backend.floatx())
+
+    # views on the anchor states of the batch
+    regression_states = regression_batch[:, :, -1]
+    labels_states     = labels_batch[:, :, -1]
+
+    # quantities shared by all images in the group
+    anchors_centers_x = (anchors[:, 0] + anchors[:, 2]) / 2
+    anchors_centers_y = (anchors[:, 1] + anchors[:, 3]) / 2
+
+    for index, (image, annotations) in enumerate(zip(image_group, annotations_group)):
+        bboxes = annotations['bboxes']
+        if bboxes.shape[0]:
+            positive_indices, assigned_indices, ignore_mask = _assign_anchors(
+                anchors, bboxes, negative_overlap, positive_overlap, num_threads
+            )
+
+            labels_states[index, ignore_mask]          = -1
+            labels_states[index, positive_indices]     = 1
+            regression_states[index, ignore_mask]      = -1
+            regression_states[index, positive_indices] = 1
+
+            labels_batch[index, positive_indices, annotations['labels'][assigned_indices].astype(int)] = 1
+            regression_batch[index, positive_indices, :-1] = bbox_transform(anchors[positive_indices], bboxes[assigned_indices, :])
+
+        # ignore annotations outside of image
+        if image.shape:
+            outside = (anchors_centers_x >= image.shape[1]) | (anchors_centers_y >= image.shape[0])
+
+            labels_states[index, outside]     = -1
+            regression_states[index, outside] = -1
+
+    return regression_batch, labels_batch
+
+
+def anchor_targets_bbox_sparse(
+    anchors,
+    image_group,
+    annotations_group,
+    num_classes,
+    negative_overlap=0.4,
+    positive_overlap=0.5,
+    num_threads=0
+):
+    """ Generate anchor targets for bbox detection in a sparse encoding, for use with losses.focal_sparse and losses.smooth_l1_sparse.
+
+    Every positive anchor is assigned exactly one class, so the classification targets of an anchor fit in a single integer,
+    and only positive anchors need regression targets. For large label sets this is orders of magnitude smaller than anchor_targets_bbox.
+
+    Args
+        anchors: np.array of annotations of shape (N, 4) for (x1, y1, x2, y2).
+        image_group: List of BGR images, only their shape is used.
+        annotations_group: List of annotations (np.array of shape (N, 5) for (x1, y1, x2, y2, label)).
+        num_classes: Number of classes to predict.
+        negative_overlap: IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
+        positive_overlap: IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+        num_threads: Number of OpenMP threads used to compute the overlaps (0 uses the OpenMP default).
+
+    Returns
+        regression_batch: np.array of shape (batch_size, P, 4 + 1), where P is the largest number of positive anchors of an image in the batch.
+                      The first column is the index of a positive anchor (-1 for padding), the other columns its regression targets for (x1, y1, x2, y2).
+        labels_batch: np.array of shape (batch_size, N, 1) of the smallest integer type that fits num_classes + 1,
+                      -1 for ignore, 0 for background and label + 1 for an anchor that is positive for label.
+    """
+    assert(len(image_group) == len(annotations_group)), "The length of the images and annotations need to be equal."
+    assert(len(annotations_group) > 0), "No data received to compute anchor targets for."
+    for annotations in annotations_group:
+        assert('bboxes' in annotations), "Annotations should contain bboxes."
+        assert('labels' in annotations), "Annotations should contain labels."
+
+    batch_size  = len(image_group)
+    num_anchors = anchors.shape[0]
+
+    labels_batch = np.zeros((batch_size, num_anchors, 1), dtype=np.min_scalar_type(-(num_classes + 1)))
+    codes        = labels_batch[:, :, 0]
+
+    # quantities shared by all images in the group
+    anchors_centers_x = (anchors[:, 0] + anchors[:, 2]) / 2
+    anchors_centers_y = (anchors[:, 1] + anchors[:, 3]) / 2
+
+    regression_group = []
+    for index, (image, annotations) in enumerate(zip(image_group, annotations_group)):
+        bboxes     = annotations['bboxes']
+        regression = np.zeros((0, 4 + 1), dtype=keras.backend.floatx())
+
+        if bboxes.shape[0]:
+            positive_indices, assigned_indices, ignore_mask = _assign_anchors(
+                anchors, bboxes, negative_overlap, positive_overlap, num_threads
+            )
+
+            codes[index, ignore_mask]      = -1
+            codes[index, positive_indices] = annotations['labels'][assigned_indices].astype(int) + 1
+
+        # ignore annotations outside of image
+        if image.shape:
+            outside = (anchors_centers_x >= image.shape[1]) | (anchors_centers_y >= image.shape[0])
+            codes[index, outside] = -1
+
+        if bboxes.shape[0]:
+            # positive anchors can have become ignored because they are outside of the image
+            inside           = codes[index, positive_indices] > 0
+            positive_indices = positive_indices[inside]
+            assigned_indices = assigned_indices[inside]
+
+            regression = np.empty((positive_indices.shape[0], 4 + 1), dtype=keras.backend.floatx())
+            regression[:, 0]  = positive_indices
+            regression[:, 1:] = bbox_transform(anchors[positive_indices], bboxes[assigned_indices, :])
+
+        regression_group.append(regression)
+
+    # pad the positive anchors of all images to the same number, at least one so the batch is never empty
+    max_positives    = max([1] + [regression.shape[0] for regression in regression_group])
+    regression_batch = np.full((batch_size, max_positives, 4 + 1), -1, dtype=keras.backend.floatx())
+    for index, regression in enumerate(regression_group):
+        regression_batch[index, :regression.shape[0]] = regression
+
+    return regression_batch, labels_batch
+
+
+def _assign_anchors(anchors, bboxes, negative_overlap, positive_overlap, num_threads=0):
+    """ Assign each anchor to the annotation it overlaps most with, like compute_gt_annotations.
+
+    Args
+        anchors: np.array of shape (N, 4) of type np.float32 or np.float64.
+        bboxes: np.array of shape (K, 4) with the annotations of an image, K > 0.
+        num_threads: Number of OpenMP threads used to compute the overlaps (0 uses the OpenMP default).
+
+    Returns
+        positive_indices: indices of positive anchors
+        assigned_indices: indices of the annotations assigned to the positive anchors
+        ignore_mask: boolean mask of the ignored anchors
+    """
+    max_overlaps, argmax_overlaps_inds = compute_max_overlaps(anchors, bboxes, num_threads)
+
+    positive_mask = max_overlaps >= positive_overlap
+    ignore_mask   = (max_overlaps > negative_overlap) & ~positive_mask
+
+    positive_indices = np.flatnonzero(positive_mask)
+    return positive_indices, argmax_overlaps_inds[positive_indices], ignore_mask
+
+
+def compute_max_overlaps(anchors, bboxes, num_threads=0):
+    """ Compute the largest overlap of each anchor with any of the bboxes, and the index of that bbox.
+
+    For many bboxes (dense scenes) only the bboxes that can overlap an anchor are compared with it, the result is the same.
+
+    Args
+        anchors: np.array of shape (N, 4) of type np.float32 or np.float64.
+        bboxes: np.array of shape (K, 4) for (x1, y1, x2, y2).
+        num_threads: Number of OpenMP threads (0 uses the OpenMP default, usually all cores).
+
+    Returns
+        max_overlaps: np.array of shape (N,) with the largest overlap of each anchor.
+        argmax_overlaps_inds: np.array of shape (N,) with the index of the bbox with the largest overlap.
+    """
+    bboxes = bboxes.astype(np.float64, copy=False)
+    if bboxes.shape[0] >= PRUNE_MIN_ANNOTATIONS:
+        return compute_overlap_max_pruned(anchors, bboxes, num_threads=num_threads)
+    return compute_overlap_max(anchors, bboxes, num_threads=num_threads)
 
 
 def compute_gt_annotations(
     anchors,
     annotations,
     negative_overlap=0.4,
-    positive_overlap=0.5
+    positive_overlap=0.5,
+    num_threads=0
 ):
     """ Obtain indices of gt annotations with the greatest overlap.
 
@@ -132,6 +340,7 @@ def compute_gt_annotations(
         annotations: np.array of shape (N, 5) for (x1, y1, x2, y2, label).
         negative_overlap: IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
         positive_overlap: IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+        num_threads: Number of OpenMP threads used to compute the overlaps (0 uses the OpenMP default).
 
     Returns
         positive_indices: indices of positive anchors
@@ -139,9 +348,7 @@ def compute_gt_annotations(
         argmax_overlaps_inds: ordered overlaps indices
     """
 
-    overlaps = compute_overlap(anchors.astype(np.float64), annotations.astype(np.float64))
-    argmax_overlaps_inds = np.argmax(overlaps, axis=1)
-    max_overlaps = overlaps[np.arange(overlaps.shape[0]), argmax_overlaps_inds]
+    max_overlaps, argmax_overlaps_inds = compute_max_overlaps(anchors, annotations, num_threads)
 
     # assign "dont care" labels
     positive_indices = max_overlaps >= positive_overlap
@@ -229,27 +436,85 @@ def anchors_for_shape(
         shapes_callback = guess_shapes
     image_shapes = shapes_callback(image_shape, pyramid_levels)
 
-    # compute anchors over all pyramid levels
-    all_anchors = np.zeros((0, 4))
-    for idx, p in enumerate(pyramid_levels):
-        anchors = generate_anchors(
+    # generate the base anchors and count the anchors for each pyramid level
+    base_anchors = [
+        generate_anchors(
             base_size=anchor_params.sizes[idx],
             ratios=anchor_params.ratios,
             scales=anchor_params.scales
-        )
-        shifted_anchors = shift(image_shapes[idx], anchor_params.strides[idx], anchors)
-        all_anchors     = np.append(all_anchors, shifted_anchors, axis=0)
+        ) for idx in range(len(pyramid_levels))
+    ]
+    counts = [int(np.prod(image_shapes[idx][:2])) * base_anchors[idx].shape[0] for idx in range(len(pyramid_levels))]
+
+    # compute anchors over all pyramid levels, directly into a single array
+    all_anchors = np.empty((sum(counts), 4))
+    start = 0
+    for idx, count in enumerate(counts):
+        shift(image_shapes[idx], anchor_params.strides[idx], base_anchors[idx], out=all_anchors[start:start + count])
+        start += count
 
     return all_anchors
 
 
-def shift(shape, stride, anchors):
+_anchors_cache      = OrderedDict()
+_anchors_cache_lock = threading.Lock()
+
+
+def cached_anchors_for_shape(
+    image_shape,
+    pyramid_levels=None,
+    anchor_params=None,
+    shapes_callback=None,
+    cache_size=32,
+):
+    """ Memoized version of anchors_for_shape.
+
+    Anchors are cached per image shape, pyramid levels, anchor parameters and shapes callback,
+    keeping the cache_size most recently used grids. The returned arrays are read-only, since they are shared.
+
+    Args
+        See anchors_for_shape.
+        cache_size: Maximum number of anchor grids to keep.
+
+    Returns
+        np.array of shape (N, 4) containing the (x1, y1, x2, y2) coordinates for the anchors.
+    """
+    params = anchor_params or AnchorParameters.default
+    key = (
+        tuple(image_shape),
+        tuple(pyramid_levels) if pyramid_levels is not None else None,
+        tuple(params.sizes),
+        tuple(params.strides),
+        tuple(np.asarray(params.ratios).tolist()),
+        tuple(np.asarray(params.scales).tolist()),
+        shapes_callback,
+    )
+
+    with _anchors_cache_lock:
+        anchors = _anchors_cache.get(key)
+        if anchors is not None:
+            _anchors_cache.move_to_end(key)
+            return anchors
+
+    anchors = anchors_for_shape(image_shape, pyramid_levels=pyramid_levels, anchor_params=anchor_params, shapes_callback=shapes_callback)
+    anchors.setflags(write=False)
+
+    with _anchors_cache_lock:
+        _anchors_cache[key] = anchors
+        while len(_anchors_cache) > cache_size:
+            _anchors_cache.popitem(last=False)
+
+    return anchors
+
+
+def shift(shape, stride, anchors, out=None):
     """ Produce shifted anchors based on shape of the map and stride size.
 
     Args
         shape  : Shape to shift the anchors over.
         stride : Stride to shift the anchors with over the shape.
         anchors: The anchors to apply at each location.
+        out    : Optional contiguous array of shape (K * A, 4) to write the shifted anchors to.
     """
 
     # create a grid starting from half stride from the top left corner
@@ -269,10 +534,11 @@ def shift(shape, stride, anchors):
     # reshape to (K*A, 4) shifted anchors
     A = anchors.shape[0]
     K = shifts.shape[0]
-    all_anchors = (anchors.reshape((1, A, 4)) + shifts.reshape((1, K, 4)).transpose((1, 0, 2)))
-    all_anchors = all_anchors.reshape((K * A, 4))
+    if out is None:
+        out = np.empty((K * A, 4))
+    np.add(anchors.reshape((1, A, 4)), shifts.reshape((1, K, 4)).transpose((1, 0, 2)), out=out.reshape((K, A, 4)))
 
-    return all_anchors
+    return out
 
 
 def generate_anchors(base_size=16, ratios=None, scales=None):
@@ -0,0 +1,218 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+import zlib
+
+import numpy as np
+
+
+def _member_name(name):
+    """ Normalize the name of an archive member, or of a path relative to the archive root.
+    """
+    name = name.replace(os.sep, '/')
+    while name.startswith('./'):
+        name = name[2:]
+    return name.lstrip('/')
+
+
+def _index_tar(path):
+    """ Returns (name, offset, stored size, size, compression method) for every regular file in an uncompressed tar archive.
+    """
+    try:
+        archive = tarfile.open(path, 'r:')
+    except tarfile.ReadError:
+        raise ValueError('Can\'t index \'{}\', only uncompressed tar archives can be read at random.'.format(path))
+
+    with archive:
+        return [
+            (_member_name(member.name), member.offset_data, member.size, member.size, zipfile.ZIP_STORED)
+            for member in archive
+            if member.isfile() and not member.issparse()
+        ]
+
+
+def _index_zip(path):
+    """ Returns (name, offset, stored size, size, compression method) for every file in a zip archive.
+    """
+    entries = []
+    with zipfile.ZipFile(path, 'r') as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.filename.endswith('/'):
+                continue
+            if info.flag_bits & 0x1:
+                raise ValueError('Can\'t index \'{}\', member \'{}\' is encrypted.'.format(path, info.filename))
+            if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                raise ValueError('Can\'t index \'{}\', member \'{}\' uses an unsupported compression method.'.format(path, info.filename))
+
+            # the data starts after the local header, whose extra field can differ from the one in the central directory
+            f.seek(info.header_offset)
+            header = f.read(30)
+            if header[:4] != b'PK\x03\x04':
+                raise ValueError('Invalid local header for member \'{}\' in \'{}\'.'.format(info.filename, path))
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            offset = info.header_offset + 30 + name_length + extra_length
+
+            entries.append((_member_name(info.filename), offset, info.compress_size, info.file_size, info.compress_type))
+
+    return entries
+
+
+class ArchiveImageSource(object):
+    """ Image source reading images from a tar or zip archive without extracting it.
+
+    Paths of images are mapped to members of the archive relative to root, so generators can keep using their own image paths.
+    The offsets of the members are indexed once and stored next to the archive,
+    after which members are read with a single pread on a file that is kept open (per process).
+
+    Args
+        archive_path : Path to an uncompressed tar archive, or a zip archive (stored or deflated members).
+        root         : The directory the archive stands in for, image paths are taken relative to it (defaults to the paths as they are).
+        index_path   : Path of the member index (defaults to the archive path with '.index.npz' appended).
+    """
+
+    def __init__(self, archive_path, root=None, index_path=None):
+        self.archive_path = archive_path
+        self.root         = root
+        self.index_path   = index_path or archive_path + '.index.npz'
+
+        self._fd   = None
+        self._pid  = None
+        self._lock = threading.Lock()
+
+        self.load_index()
+
+    def _archive_stat(self):
+        stat = os.stat(self.archive_path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def build_index(self):
+        """ Index the members of the archive and store the index.
+        """
+        if zipfile.is_zipfile(self.archive_path):
+            entries = _index_zip(self.archive_path)
+        else:
+            entries = _index_tar(self.archive_path)
+
+        names, offsets, stored_sizes, sizes, methods = zip(*entries) if entries else ((), (), (), (), ())
+        with open(self.index_path, 'wb') as f:
+            np.savez(
+                f,
+                archive=self._archive_stat(),
+                names=np.array(names, dtype=np.str_),
+                offsets=np.array(offsets, dtype=np.int64),
+                stored_sizes=np.array(stored_sizes, dtype=np.int64),
+                sizes=np.array(sizes, dtype=np.int64),
+                methods=np.array(methods, dtype=np.int16),
+            )
+
+    def load_index(self):
+        """ Load the member index, building it first if it doesn't exist or the archive changed.
+        """
+        up_to_date = False
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path) as index:
+                up_to_date = np.array_equal(index['archive'], self._archive_stat())
+
+        if not up_to_date:
+            self.build_index()
+
+        with np.load(self.index_path) as index:
+            self.offsets      = index['offsets']
+            self.stored_sizes = index['stored_sizes']
+            self.sizes        = index['sizes']
+            self.methods      = index['methods']
+            self.members      = dict((str(name), i) for i, name in enumerate(index['names']))
+
+    def member(self, path):
+        """ Returns the name of the archive member for an image path.
+        """
+        if self.root is not None:
+            path = os.path.relpath(path, self.root)
+        return _member_name(path)
+
+    def __contains__(self, path):
+        return self.member(path) in self.members
+
+    def _file(self):
+        """ Returns the file descriptor of the archive, opened once per process.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    # a descriptor inherited from the parent process is still open in this process, close our copy of it
+                    if self._fd is not None:
+                        os.close(self._fd)
+                    self._fd  = os.open(self.archive_path, os.O_RDONLY)
+                    self._pid = pid
+        return self._fd
+
+    def close(self):
+        """ Close the archive, it is opened again when a member is read.
+        """
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd  = None
+            self._pid = None
+
+    def after_fork(self):
+        """ Close the descriptor inherited from the parent process and recreate the lock, call this in a forked process.
+        """
+        self._lock = threading.Lock()
+        self.close()
+
+    def read(self, path):
+        """ Returns the contents of the member for an image path.
+        """
+        member = self.member(path)
+        index  = self.members.get(member)
+        if index is None:
+            raise IOError('\'{}\' (member \'{}\') not found in \'{}\'.'.format(path, member, self.archive_path))
+
+        stored_size = int(self.stored_sizes[index])
+        data        = os.pread(self._file(), stored_size, int(self.offsets[index]))
+        if len(data) != stored_size:
+            raise IOError('Unexpected end of \'{}\' while reading \'{}\'.'.format(self.archive_path, member))
+
+        if self.methods[index] == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS, int(self.sizes[index]))
+
+        return data
+
+    def open(self, path):
+        """ Returns a file object with the contents of the member for an image path.
+        """
+        return io.BytesIO(self.read(path))
+
+    def __getstate__(self):
+        """ Pickle without the file descriptor and lock, the archive is reopened on first use.
+        """
+        state = self.__dict__.copy()
+        state['_fd']  = None
+        state['_pid'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
@@ -0,0 +1,349 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import csv
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .image import read_image_size
+
+
+class ImageCache(object):
+    """ Least recently used cache for decoded images, bounded by the number of bytes it holds.
+
+    Args
+        max_bytes: The maximum total size in bytes of the cached values.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+
+        self._entries = OrderedDict()
+        self._lock    = threading.Lock()
+
+    def get(self, key):
+        """ Returns the value cached for key, or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        """ Add a value to the cache, evicting the least recently used values if the cache is full.
+
+        Args
+            key    : The key to store the value under.
+            value  : The value to store, usually an np.ndarray.
+            nbytes : The size of the value in bytes (defaults to value.nbytes).
+        """
+        if nbytes is None:
+            nbytes = value.nbytes
+
+        # values that can never fit are not cached at all
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_bytes
+
+    def clear(self):
+        """ Remove all values from the cache and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits   = 0
+            self.misses = 0
+
+    def hit_rate(self):
+        """ Returns the fraction of lookups that were served from the cache.
+        """
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getstate__(self):
+        """ Pickle an empty cache with the same budget, locks and cached images are not transferred.
+        """
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+
+class ResizedImageCache(object):
+    """ On-disk cache of images that are already resized to the input size of the network.
+
+    The images are stored as uint8 pixels in a single file that is memory-mapped for reading,
+    so loading an image from the cache returns a read-only view without copying or decoding.
+    Each set of resize parameters gets its own directory, so changing them never reads stale pixels.
+
+    Args
+        cache_dir : Directory in which the cache is stored.
+        min_side  : The min_side the images are resized with.
+        max_side  : The max_side the images are resized with.
+    """
+
+    index_dtype = np.dtype([
+        ('offset', np.int64),
+        ('height', np.int32),
+        ('width',  np.int32),
+        ('scale',  np.float64),
+    ])
+
+    def __init__(self, cache_dir, min_side, max_side):
+        self.min_side = min_side
+        self.max_side = max_side
+        self.path     = os.path.join(cache_dir, 'resized_{}_{}'.format(min_side, max_side))
+
+        self.index  = None
+        self.pixels = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def is_valid(self, fingerprint):
+        """ Returns True if the cache is complete and was built for the dataset with the given fingerprint.
+        """
+        try:
+            with open(self._file('meta.json'), 'r') as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+
+        return meta == {'min_side': self.min_side, 'max_side': self.max_side, 'fingerprint': fingerprint}
+
+    def build(self, images, fingerprint):
+        """ Write the cache.
+
+        Args
+            images      : Iterable of (image, scale) tuples in image index order, where the images are already resized.
+            fingerprint : String identifying the dataset, used to detect a stale cache.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # the metadata is written last, an interrupted build is never considered valid
+        if os.path.exists(self._file('meta.json')):
+            os.remove(self._file('meta.json'))
+
+        index  = []
+        offset = 0
+        with open(self._file('pixels.bin'), 'wb') as f:
+            for image, scale in images:
+                image = np.ascontiguousarray(image, dtype=np.uint8)
+                f.write(image.data)
+                index.append((offset, image.shape[0], image.shape[1], scale))
+                offset += image.nbytes
+
+        np.save(self._file('index.npy'), np.array(index, dtype=self.index_dtype))
+        with open(self._file('meta.json'), 'w') as f:
+            json.dump({'min_side': self.min_side, 'max_side': self.max_side, 'fingerprint': fingerprint}, f)
+
+        self.index  = None
+        self.pixels = None
+
+    def open(self):
+        """ Map the cache into memory.
+        """
+        self.index = np.load(self._file('index.npy'))
+        if os.path.getsize(self._file('pixels.bin')):
+            self.pixels = np.memmap(self._file('pixels.bin'), dtype=np.uint8, mode='r')
+        else:
+            self.pixels = np.zeros((0,), dtype=np.uint8)
+
+    def get(self, image_index):
+        """ Returns the resized image for image_index as a read-only view and the scale it was resized with.
+        """
+        if self.index is None:
+            self.open()
+
+        entry  = self.index[image_index]
+        offset = int(entry['offset'])
+        height = int(entry['height'])
+        width  = int(entry['width'])
+
+        image = self.pixels[offset:offset + height * width * 3].reshape((height, width, 3))
+        return image, float(entry['scale'])
+
+    def __getstate__(self):
+        """ Pickle without the memory maps, they are reopened on first use.
+        """
+        state = self.__dict__.copy()
+        state['index']  = None
+        state['pixels'] = None
+        return state
+
+
+class ImageSizeIndex(object):
+    """ Persistent index of the width and height of image files.
+
+    The index is stored as a CSV file with one row per image (path, width, height, mtime, file size).
+    Images are only opened when they are new or when their modification time or file size changed,
+    and then only their header is read.
+
+    Args
+        path: Path of the index file.
+    """
+
+    def __init__(self, path):
+        self.path    = path
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            self.load()
+
+    def load(self):
+        """ Read the index file.
+        """
+        with open(self.path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for image_path, width, height, mtime, file_size in reader:
+                self.entries[image_path] = (int(width), int(height), int(mtime), int(file_size))
+
+    def save(self):
+        """ Write the index file, replacing the previous one atomically.
+        """
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['path', 'width', 'height', 'mtime', 'size'])
+            for image_path, entry in self.entries.items():
+                writer.writerow((image_path,) + entry)
+        os.replace(temporary_path, self.path)
+
+    def update(self, image_paths, map_function=map):
+        """ Make sure the index contains up to date sizes for image_paths, and only for those.
+
+        Args
+            image_paths  : Paths of the images to index.
+            map_function : Function used to map over the paths, use a thread pool map to stat and read the files in parallel.
+
+        Returns
+            The number of images whose size was (re)read.
+        """
+        def refresh(image_path):
+            stat  = os.stat(image_path)
+            entry = self.entries.get(image_path)
+            if entry is not None and entry[2:] == (stat.st_mtime_ns, stat.st_size):
+                return entry, False
+
+            width, height = read_image_size(image_path)
+            return (width, height, stat.st_mtime_ns, stat.st_size), True
+
+        image_paths = list(image_paths)
+        results     = list(map_function(refresh, image_paths))
+        changed     = sum(1 for _, updated in results if updated)
+
+        stale        = len(self.entries) != len(image_paths)
+        self.entries = dict((image_path, entry) for image_path, (entry, _) in zip(image_paths, results))
+        if changed or stale or not os.path.exists(self.path):
+            self.save()
+
+        return changed
+
+    def size(self, image_path):
+        """ Returns the (width, height) of the image at image_path.
+        """
+        return self.entries[image_path][:2]
+
+
+class BufferPool(object):
+    """ Pool of preallocated arrays, reused in a round-robin fashion per shape and dtype.
+
+    A buffer is handed out again after buffers_per_shape other requests for the same shape,
+    so that number must be larger than the number of buffers that can be in use at the same time.
+    Buffers are only reused when shapes repeat, hit_rate shows how often that happens.
+
+    Args
+        buffers_per_shape : Number of buffers to rotate through for each shape.
+        max_shapes        : Number of shapes to keep buffers for, the least recently used shape is dropped first.
+    """
+
+    def __init__(self, buffers_per_shape, max_shapes=16):
+        self.buffers_per_shape = int(buffers_per_shape)
+        self.max_shapes        = int(max_shapes)
+        self.hits              = 0
+        self.misses            = 0
+
+        self._rings = OrderedDict()
+        self._lock  = threading.Lock()
+
+    def get(self, shape, dtype):
+        """ Returns a buffer of the given shape and dtype, its contents are undefined.
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                ring = self._rings[key] = {'buffers': [], 'next': 0}
+                while len(self._rings) > self.max_shapes:
+                    self._rings.popitem(last=False)
+            else:
+                self._rings.move_to_end(key)
+
+            if len(ring['buffers']) < self.buffers_per_shape:
+                self.misses += 1
+                buffer = np.empty(shape, dtype=dtype)
+                ring['buffers'].append(buffer)
+            else:
+                self.hits += 1
+                buffer = ring['buffers'][ring['next']]
+                ring['next'] = (ring['next'] + 1) % self.buffers_per_shape
+
+            return buffer
+
+    def hit_rate(self):
+        """ Returns the fraction of requests that reused a buffer.
+        """
+        requests = self.hits + self.misses
+        return float(self.hits) / requests if requests else 0.0
+
+    def __getstate__(self):
+        """ Pickle an empty pool with the same configuration.
+        """
+        return {'buffers_per_shape': self.buffers_per_shape, 'max_shapes': self.max_shapes}
+
+    def __setstate__(self, state):
+        self.__init__(state['buffers_per_shape'], state['max_shapes'])
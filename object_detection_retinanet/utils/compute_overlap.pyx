@@ -6,48 +6,354 @@
 # --------------------------------------------------------
 
 cimport cython
+cimport openmp
+from cython.parallel cimport prange
 import numpy as np
 cimport numpy as np
 
 
+ctypedef fused boxes_t:
+    float
+    double
+
+ctypedef fused query_boxes_t:
+    float
+    double
+
+
+cdef inline double _box_overlap(
+    double x1, double y1, double x2, double y2, double box_area,
+    double query_x1, double query_y1, double query_x2, double query_y2, double query_area
+) nogil:
+    """ Overlap of two boxes, with the +1 pixel convention of py-faster-rcnn.
+    """
+    cdef double iw, ih
+    iw = min(x2, query_x2) - max(x1, query_x1) + 1
+    if iw > 0:
+        ih = min(y2, query_y2) - max(y1, query_y1) + 1
+        if ih > 0:
+            return iw * ih / (box_area + query_area - iw * ih)
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _query_areas(const query_boxes_t[:, :] query_boxes):
+    """ Areas of the query boxes in double precision.
+    """
+    cdef Py_ssize_t K = query_boxes.shape[0]
+    areas_array = np.empty((K,), dtype=np.float64)
+    cdef double[::1] areas = areas_array
+    cdef Py_ssize_t k
+    for k in range(K):
+        areas[k] = (
+            (<double>query_boxes[k, 2] - <double>query_boxes[k, 0] + 1) *
+            (<double>query_boxes[k, 3] - <double>query_boxes[k, 1] + 1)
+        )
+    return areas_array
+
+
+cdef inline int _num_threads(int num_threads) nogil:
+    """ The number of OpenMP threads to use, num_threads <= 0 means the OpenMP default (usually all cores).
+    """
+    if num_threads <= 0:
+        return openmp.omp_get_max_threads()
+    return num_threads
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def compute_overlap(
-    np.ndarray[double, ndim=2] boxes,
-    np.ndarray[double, ndim=2] query_boxes
+    const boxes_t[:, :] boxes,
+    const query_boxes_t[:, :] query_boxes,
+    int num_threads=0
 ):
     """
+    Accepts float32 or float64 boxes without converting them, and splits the boxes over OpenMP threads without holding the GIL.
+    The overlaps are computed in double precision.
+
     Args
-        a: (N, 4) ndarray of float
-        b: (K, 4) ndarray of float
+        a: (N, 4) ndarray of float32 or float64
+        b: (K, 4) ndarray of float32 or float64
+        num_threads: Number of OpenMP threads (defaults to the OpenMP default, usually all cores).
 
     Returns
         overlaps: (N, K) ndarray of overlap between boxes and query_boxes
     """
-    cdef unsigned int N = boxes.shape[0]
-    cdef unsigned int K = query_boxes.shape[0]
-    cdef np.ndarray[double, ndim=2] overlaps = np.zeros((N, K), dtype=np.float64)
-    cdef double iw, ih, box_area
-    cdef double ua
-    cdef unsigned int k, n
-    for k in range(K):
-        box_area = (
-            (query_boxes[k, 2] - query_boxes[k, 0] + 1) *
-            (query_boxes[k, 3] - query_boxes[k, 1] + 1)
-        )
-        for n in range(N):
-            iw = (
-                min(boxes[n, 2], query_boxes[k, 2]) -
-                max(boxes[n, 0], query_boxes[k, 0]) + 1
+    cdef Py_ssize_t N = boxes.shape[0]
+    cdef Py_ssize_t K = query_boxes.shape[0]
+    overlaps_array = np.zeros((N, K), dtype=np.float64)
+    cdef double[:, ::1] overlaps = overlaps_array
+    cdef const double[::1] query_areas = _query_areas(query_boxes)
+    cdef double box_area
+    cdef Py_ssize_t k, n
+
+    if N == 0 or K == 0:
+        return overlaps_array
+
+    num_threads = _num_threads(num_threads)
+    with nogil:
+        for n in prange(N, schedule='static', num_threads=num_threads):
+            box_area = (
+                (<double>boxes[n, 2] - <double>boxes[n, 0] + 1) *
+                (<double>boxes[n, 3] - <double>boxes[n, 1] + 1)
             )
-            if iw > 0:
-                ih = (
-                    min(boxes[n, 3], query_boxes[k, 3]) -
-                    max(boxes[n, 1], query_boxes[k, 1]) + 1
+            for k in range(K):
+                overlaps[n, k] = _box_overlap(
+                    boxes[n, 0], boxes[n, 1], boxes[n, 2], boxes[n, 3], box_area,
+                    query_boxes[k, 0], query_boxes[k, 1], query_boxes[k, 2], query_boxes[k, 3], query_areas[k]
                 )
-                if ih > 0:
-                    ua = np.float64(
-                        (boxes[n, 2] - boxes[n, 0] + 1) *
-                        (boxes[n, 3] - boxes[n, 1] + 1) +
-                        box_area - iw * ih
+    return overlaps_array
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def compute_overlap_max(
+    const boxes_t[:, :] boxes,
+    const query_boxes_t[:, :] query_boxes,
+    bint query_max=False,
+    int num_threads=0
+):
+    """ Reduce the overlaps of compute_overlap to their maximum per box, without building the (N, K) matrix.
+
+    Ties resolve to the lowest index, like np.argmax. Memory use is linear in N,
+    the boxes are split in chunks over OpenMP threads without holding the GIL.
+
+    Args
+        a: (N, 4) ndarray of float32 or float64
+        b: (K, 4) ndarray of float32 or float64
+        query_max: Also return the maximum overlap of each query box and the index of the box it is reached for.
+        num_threads: Number of OpenMP threads (defaults to the OpenMP default, usually all cores).
+
+    Returns
+        max_overlaps: (N,) ndarray with the largest overlap of each box with any query box.
+        argmax_overlaps: (N,) ndarray with the index of the query box with the largest overlap.
+        query_max_overlaps: (K,) ndarray with the largest overlap of each query box, only if query_max is True.
+        query_argmax_overlaps: (K,) ndarray with the index of the box with the largest overlap, only if query_max is True.
+    """
+    cdef Py_ssize_t N = boxes.shape[0]
+    cdef Py_ssize_t K = query_boxes.shape[0]
+    cdef const double[::1] query_areas = _query_areas(query_boxes)
+
+    max_overlaps_array    = np.zeros((N,), dtype=np.float64)
+    argmax_overlaps_array = np.zeros((N,), dtype=np.int64)
+    cdef double[::1] max_overlaps       = max_overlaps_array
+    cdef np.int64_t[::1] argmax_overlaps = argmax_overlaps_array
+
+    # the per query box maxima are reduced per chunk of boxes first, then over the chunks in order
+    cdef Py_ssize_t num_chunks = min(N, 256) if query_max else 0
+    cdef Py_ssize_t chunk_size = (N + num_chunks - 1) // num_chunks if num_chunks else 0
+    chunk_max_array    = np.zeros((num_chunks, K), dtype=np.float64)
+    chunk_argmax_array = np.zeros((num_chunks, K), dtype=np.int64)
+    cdef double[:, ::1] chunk_max        = chunk_max_array
+    cdef np.int64_t[:, ::1] chunk_argmax = chunk_argmax_array
+
+    cdef double box_area, overlap, best
+    cdef Py_ssize_t k, n, c, best_k
+
+    num_threads = _num_threads(num_threads)
+    if K > 0 and N > 0:
+        with nogil:
+            if query_max:
+                for c in prange(num_chunks, schedule='static', num_threads=num_threads):
+                    for n in range(c * chunk_size, min((c + 1) * chunk_size, N)):
+                        box_area = (
+                            (<double>boxes[n, 2] - <double>boxes[n, 0] + 1) *
+                            (<double>boxes[n, 3] - <double>boxes[n, 1] + 1)
+                        )
+                        best   = 0
+                        best_k = 0
+                        for k in range(K):
+                            overlap = _box_overlap(
+                                boxes[n, 0], boxes[n, 1], boxes[n, 2], boxes[n, 3], box_area,
+                                query_boxes[k, 0], query_boxes[k, 1], query_boxes[k, 2], query_boxes[k, 3], query_areas[k]
+                            )
+                            if overlap > best:
+                                best   = overlap
+                                best_k = k
+                            if overlap > chunk_max[c, k]:
+                                chunk_max[c, k]    = overlap
+                                chunk_argmax[c, k] = n
+                        max_overlaps[n]    = best
+                        argmax_overlaps[n] = best_k
+            else:
+                for n in prange(N, schedule='static', num_threads=num_threads):
+                    box_area = (
+                        (<double>boxes[n, 2] - <double>boxes[n, 0] + 1) *
+                        (<double>boxes[n, 3] - <double>boxes[n, 1] + 1)
                     )
-                    overlaps[n, k] = iw * ih / ua
-    return overlaps
+                    best   = 0
+                    best_k = 0
+                    for k in range(K):
+                        overlap = _box_overlap(
+                            boxes[n, 0], boxes[n, 1], boxes[n, 2], boxes[n, 3], box_area,
+                            query_boxes[k, 0], query_boxes[k, 1], query_boxes[k, 2], query_boxes[k, 3], query_areas[k]
+                        )
+                        if overlap > best:
+                            best   = overlap
+                            best_k = k
+                    max_overlaps[n]    = best
+                    argmax_overlaps[n] = best_k
+
+    if not query_max:
+        return max_overlaps_array, argmax_overlaps_array
+
+    query_max_overlaps_array    = np.zeros((K,), dtype=np.float64)
+    query_argmax_overlaps_array = np.zeros((K,), dtype=np.int64)
+    cdef double[::1] query_max_overlaps        = query_max_overlaps_array
+    cdef np.int64_t[::1] query_argmax_overlaps = query_argmax_overlaps_array
+    for c in range(num_chunks):
+        for k in range(K):
+            if chunk_max[c, k] > query_max_overlaps[k]:
+                query_max_overlaps[k]    = chunk_max[c, k]
+                query_argmax_overlaps[k] = chunk_argmax[c, k]
+
+    return max_overlaps_array, argmax_overlaps_array, query_max_overlaps_array, query_argmax_overlaps_array
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline Py_ssize_t _lower_bound(const double[::1] values, Py_ssize_t lo, Py_ssize_t hi, double value) nogil:
+    """ Index of the first element in values[lo:hi] that is not smaller than value, values[lo:hi] must be sorted.
+    """
+    cdef Py_ssize_t mid
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if values[mid] < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _interval_index(query_boxes):
+    """ Index query boxes for compute_overlap_max_pruned.
+
+    The query boxes are split in classes of similar width (within a factor two) and sorted by x1 within each class,
+    so the query boxes that can overlap a box are a contiguous range of each class.
+
+    Returns
+        order: (K,) indices of the query boxes, sorted by class and x1.
+        x1: (K,) x1 of the query boxes in that order.
+        starts: (C + 1,) start of each class in order.
+        max_widths: (C,) largest width of the query boxes in each class.
+    """
+    widths  = np.maximum(query_boxes[:, 2] - query_boxes[:, 0] + 1, 1)
+    classes = np.floor(np.log2(widths)).astype(np.int64)
+    order   = np.lexsort((query_boxes[:, 0], classes))
+
+    classes = classes[order]
+    starts  = np.flatnonzero(np.concatenate([[True], classes[1:] != classes[:-1], [True]]))
+    max_widths = np.maximum.reduceat(widths[order], starts[:-1])
+
+    return (
+        order.astype(np.int64),
+        np.ascontiguousarray(query_boxes[order, 0], dtype=np.float64),
+        starts.astype(np.int64),
+        max_widths.astype(np.float64),
+    )
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def compute_overlap_max_pruned(
+    const boxes_t[:, :] boxes,
+    const query_boxes_t[:, :] query_boxes,
+    bint query_max=False,
+    int num_threads=0
+):
+    """ Same as compute_overlap_max, but only tests the query boxes that can overlap each box.
+
+    The query boxes are indexed by x1 (see _interval_index), so for many query boxes, such as crowded scenes,
+    each box is compared with a small number of candidates instead of all query boxes.
+    Query boxes outside the candidate ranges have an overlap of exactly zero, so the results are identical to compute_overlap_max,
+    including ties that resolve to the lowest index.
+
+    Args
+        a: (N, 4) ndarray of float32 or float64
+        b: (K, 4) ndarray of float32 or float64
+        query_max: Also return the maximum overlap of each query box and the index of the box it is reached for.
+        num_threads: Number of OpenMP threads (defaults to the OpenMP default, usually all cores).
+
+    Returns
+        See compute_overlap_max.
+    """
+    cdef Py_ssize_t N = boxes.shape[0]
+    cdef Py_ssize_t K = query_boxes.shape[0]
+    cdef const double[::1] query_areas = _query_areas(query_boxes)
+
+    max_overlaps_array    = np.zeros((N,), dtype=np.float64)
+    argmax_overlaps_array = np.zeros((N,), dtype=np.int64)
+    cdef double[::1] max_overlaps        = max_overlaps_array
+    cdef np.int64_t[::1] argmax_overlaps = argmax_overlaps_array
+
+    # the per query box maxima are reduced per chunk of boxes first, then over the chunks in order
+    cdef Py_ssize_t num_chunks = min(N, 256)
+    cdef Py_ssize_t chunk_size = (N + num_chunks - 1) // num_chunks if num_chunks else 0
+    chunk_max_array    = np.zeros((num_chunks if query_max else 0, K), dtype=np.float64)
+    chunk_argmax_array = np.zeros((num_chunks if query_max else 0, K), dtype=np.int64)
+    cdef double[:, ::1] chunk_max        = chunk_max_array
+    cdef np.int64_t[:, ::1] chunk_argmax = chunk_argmax_array
+
+    if K == 0 or N == 0:
+        num_chunks = 0
+        order_array, x1_array, starts_array, max_widths_array = (
+            np.zeros((0,), dtype=np.int64), np.zeros((0,)), np.zeros((1,), dtype=np.int64), np.zeros((0,))
+        )
+    else:
+        order_array, x1_array, starts_array, max_widths_array = _interval_index(np.asarray(query_boxes, dtype=np.float64))
+    cdef const np.int64_t[::1] order  = order_array
+    cdef const double[::1] x1         = x1_array
+    cdef const np.int64_t[::1] starts = starts_array
+    cdef const double[::1] max_widths = max_widths_array
+    cdef Py_ssize_t num_classes       = max_widths.shape[0]
+
+    cdef double box_area, overlap, best
+    cdef Py_ssize_t k, n, c, i, g, lo, hi, best_k
+
+    num_threads = _num_threads(num_threads)
+    with nogil:
+        for c in prange(num_chunks, schedule='static', num_threads=num_threads):
+            for n in range(c * chunk_size, min((c + 1) * chunk_size, N)):
+                box_area = (
+                    (<double>boxes[n, 2] - <double>boxes[n, 0] + 1) *
+                    (<double>boxes[n, 3] - <double>boxes[n, 1] + 1)
+                )
+                best   = 0
+                best_k = 0
+                for g in range(num_classes):
+                    # candidates satisfy x1 - 1 < box x2 and x1 + width > box x1 - 1, with a margin of one pixel
+                    lo = _lower_bound(x1, starts[g], starts[g + 1], <double>boxes[n, 0] - 2 - max_widths[g])
+                    hi = _lower_bound(x1, lo, starts[g + 1], <double>boxes[n, 2] + 2)
+                    for i in range(lo, hi):
+                        k = order[i]
+                        overlap = _box_overlap(
+                            boxes[n, 0], boxes[n, 1], boxes[n, 2], boxes[n, 3], box_area,
+                            query_boxes[k, 0], query_boxes[k, 1], query_boxes[k, 2], query_boxes[k, 3], query_areas[k]
+                        )
+                        if overlap > best or (overlap == best and k < best_k):
+                            best   = overlap
+                            best_k = k
+                        if query_max and overlap > chunk_max[c, k]:
+                            chunk_max[c, k]    = overlap
+                            chunk_argmax[c, k] = n
+                max_overlaps[n]    = best
+                argmax_overlaps[n] = best_k
+
+    if not query_max:
+        return max_overlaps_array, argmax_overlaps_array
+
+    query_max_overlaps_array    = np.zeros((K,), dtype=np.float64)
+    query_argmax_overlaps_array = np.zeros((K,), dtype=np.int64)
+    cdef double[::1] query_max_overlaps        = query_max_overlaps_array
+    cdef np.int64_t[::1] query_argmax_overlaps = query_argmax_overlaps_array
+    for c in range(num_chunks):
+        for k in range(K):
+            if chunk_max[c, k] > query_max_overlaps[k]:
+                query_max_overlaps[k]    = chunk_max[c, k]
+                query_argmax_overlaps[k] = chunk_argmax[c, k]
+
+    return max_overlaps_array, argmax_overlaps_array, query_max_overlaps_array, query_argmax_overlaps_array
@@ -14,7 +14,9 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from .anchors import compute_overlap
+import pyximport
+pyximport.install()
+from .compute_overlap import compute_overlap
 from .visualization import draw_detections, draw_annotations
 
 import keras
@@ -73,9 +75,9 @@ def _get_detections(generator, model, score_threshold=0.05, max_detections=100,
     all_detections = [[None for i in range(generator.num_classes()) if generator.has_label(i)] for j in range(generator.size())]
 
     for i in progressbar.progressbar(range(generator.size()), prefix='Running network: '):
-        raw_image    = generator.load_image(i)
-        image        = generator.preprocess_image(raw_image.copy())
-        image, scale = generator.resize_image(image)
+        raw_image, raw_scale = generator.load_scaled_image(i)
+        image                = generator.preprocess_input_image(raw_image)
+        image, scale         = generator.resize_image(image)
 
         if keras.backend.image_data_format() == 'channels_first':
             image = image.transpose((2, 0, 1))
@@ -84,7 +86,7 @@ def _get_detections(generator, model, score_threshold=0.05, max_detections=100,
         boxes, scores, labels = model.predict_on_batch(np.expand_dims(image, axis=0))[:3]
 
         # correct boxes for image scale
-        boxes /= scale
+        boxes /= scale * raw_scale
 
         # select indices which have a score above the threshold
         indices = np.where(scores[0, :] > score_threshold)[0]
@@ -102,8 +104,12 @@ def _get_detections(generator, model, score_threshold=0.05, max_detections=100,
         image_detections = np.concatenate([image_boxes, np.expand_dims(image_scores, axis=1), np.expand_dims(image_labels, axis=1)], axis=1)
 
         if save_path is not None:
-            draw_annotations(raw_image, generator.load_annotations(i), label_to_name=generator.label_to_name)
-            draw_detections(raw_image, image_boxes, image_scores, image_labels, label_to_name=generator.label_to_name, score_threshold=score_threshold)
+            # loaded images can be read-only (cached), draw on a copy
+            raw_image   = raw_image.copy()
+            annotations = generator.load_annotations(i)
+            annotations = {'labels': annotations['labels'], 'bboxes': annotations['bboxes'] * raw_scale}
+            draw_annotations(raw_image, annotations, label_to_name=generator.label_to_name)
+            draw_detections(raw_image, image_boxes * raw_scale, image_scores, image_labels, label_to_name=generator.label_to_name, score_threshold=score_threshold)
 
             cv2.imwrite(os.path.join(save_path, '{}.png'.format(i)), raw_image)
 
@@ -139,7 +145,7 @@ def _get_annotations(generator):
             if not generator.has_label(label):
                 continue
 
-            all_annotations[i][label] = annotations['bboxes'][annotations['labels'] == label, :].copy()
+            all_annotations[i][label] = annotations['bboxes'][annotations['labels'] == label, :].astype(np.float64)
 
     return all_annotations
 
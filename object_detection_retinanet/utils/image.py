@@ -26,11 +26,66 @@ def read_image_bgr(path):
     """ Read an image in BGR format.
 
     Args
-        path: Path to the image.
+        path: Path to the image, or a file object with the encoded image.
     """
     # We deliberately don't use cv2.imread here, since it gives no feedback on errors while reading the image.
-    image = np.asarray(Image.open(path).convert('RGB'))
-    return image[:, :, ::-1].copy()
+    return _pil_to_bgr(Image.open(path))
+
+
+def read_image_bgr_scaled(path, min_side=800, max_side=1333):
+    """ Read an image in BGR format, letting the decoder reduce its resolution towards the size it will be resized to.
+
+    JPEG images are decoded at 1/2, 1/4 or 1/8 of their size when that is still at least as large as the size
+    after resizing with min_side and max_side, other images are decoded at full size.
+
+    Args
+        path: Path to the image, or a file object with the encoded image.
+        min_side: The min_side the image will be resized with.
+        max_side: The max_side the image will be resized with.
+
+    Returns
+        The image and the scale of the decoded image w.r.t. the original image.
+    """
+    image = Image.open(path)
+    width, height = image.size
+
+    scale = compute_resize_scale((height, width, 3), min_side=min_side, max_side=max_side)
+    if scale < 0.5:
+        # the decoder picks the largest reduction for which the image is at least the requested size
+        image.draft('RGB', (int(np.ceil(width * scale)), int(np.ceil(height * scale))))
+
+    # a reduction of 1 / k maps every k x k block to one pixel (the last one possibly partial), so both axes scale by 1 / k
+    reduction = 1
+    for k in (2, 4, 8):
+        if image.size != (width, height) and image.size == (-(-width // k), -(-height // k)):
+            reduction = k
+            break
+
+    return _pil_to_bgr(image), 1.0 / reduction
+
+
+def _pil_to_bgr(image):
+    """ Decode a PIL image to a BGR np.ndarray.
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # cvtColor writes a contiguous BGR copy in one pass, instead of a reversed view and a copy of that
+    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+
+def read_image_size(path):
+    """ Read the size of an image without decoding it.
+
+    Args
+        path: Path to the image.
+
+    Returns
+        The (width, height) of the image.
+    """
+    # PIL only parses the header when opening an image
+    with Image.open(path) as image:
+        return image.width, image.height
 
 
 def preprocess_image(x, mode='caffe'):
@@ -128,7 +183,7 @@ class TransformParameters:
             return cv2.INTER_LANCZOS4
 
 
-def apply_transform(matrix, image, params):
+def apply_transform(matrix, image, params, output_shape=None):
     """
     Apply a transformation to an image.
 
@@ -138,14 +193,28 @@ def apply_transform(matrix, image, params):
     Mathematically speaking, that means that the matrix is a transformation from the transformed image space to the original image space.
 
     Args
-      matrix: A homogeneous 3 by 3 matrix holding representing the transformation to apply.
-      image:  The image to transform.
-      params: The transform parameters (see TransformParameters)
+      matrix:       A homogeneous 3 by 3 matrix holding representing the transformation to apply.
+      image:        The image to transform.
+      params:       The transform parameters (see TransformParameters)
+      output_shape: The (height, width) of the generated image (defaults to the shape of image).
     """
+    if output_shape is None:
+        output_shape = image.shape[:2]
+
+    # flips and integer translations only move pixels, they don't need a resample
+    # (lanczos4 weights are not exactly zero at integer positions, so it keeps the warp)
+    if params.cvInterpolation() != cv2.INTER_LANCZOS4 and is_integer_flip_translation(matrix):
+        output = _apply_integer_flip_translation(matrix, image, params, output_shape)
+        if output is not None:
+            # cv2.warpAffine drops the channel axis of single channel images
+            if output.ndim == 3 and output.shape[2] == 1:
+                output = output[..., 0]
+            return output
+
     output = cv2.warpAffine(
         image,
         matrix[:2, :],
-        dsize       = (image.shape[1], image.shape[0]),
+        dsize       = (output_shape[1], output_shape[0]),
         flags       = params.cvInterpolation(),
         borderMode  = params.cvBorderMode(),
         borderValue = params.cval,
@@ -153,6 +222,113 @@ def apply_transform(matrix, image, params):
     return output
 
 
+def is_integer_flip_translation(matrix, tolerance=1e-6):
+    """ Check if a transformation only flips axes and translates by whole pixels.
+
+    Args
+        matrix: A homogeneous 3 by 3 matrix.
+        tolerance: Maximum deviation from an exact flip and integer translation.
+    """
+    linear      = matrix[:2, :2]
+    translation = matrix[:2, 2]
+    return (
+        abs(linear[0, 1]) <= tolerance and
+        abs(linear[1, 0]) <= tolerance and
+        abs(abs(linear[0, 0]) - 1) <= tolerance and
+        abs(abs(linear[1, 1]) - 1) <= tolerance and
+        np.all(np.abs(translation - np.round(translation)) <= tolerance)
+    )
+
+
+def _source_indices(sign, offset, size, source_size, border_mode):
+    """ Compute the source index of every output index along an axis, mapping indices outside the source like cv2 border modes do.
+
+    Returns
+        The source indices, and a mask of the output indices that come from inside the source.
+        None if the indices reach further than one source size outside the source,
+        where cv2 doesn't follow its border modes consistently for all interpolations.
+    """
+    indices = sign * np.arange(size) + offset
+    if size and (indices.min() < 1 - source_size or indices.max() > 2 * source_size - 2):
+        return None
+
+    inside  = (indices >= 0) & (indices < source_size)
+
+    if border_mode == cv2.BORDER_WRAP:
+        indices = np.mod(indices, source_size)
+    elif border_mode == cv2.BORDER_REFLECT_101 and source_size > 1:
+        period  = 2 * (source_size - 1)
+        indices = np.mod(indices, period)
+        indices = np.where(indices >= source_size, period - indices, indices)
+    else:
+        # replicate, and a placeholder for constant borders which are filled afterwards
+        indices = np.clip(indices, 0, source_size - 1)
+
+    return indices, inside
+
+
+def _apply_integer_flip_translation(matrix, image, params, output_shape):
+    """ Apply a flip and integer translation (see is_integer_flip_translation) by indexing, with the same result as cv2.warpAffine.
+
+    Returns
+        The transformed image, or None if the transformation moves the image too far to be applied by indexing.
+    """
+    # the matrix maps source to output, so output pixel (x, y) comes from (sign * (x - tx), sign * (y - ty))
+    sign_x   = int(np.round(matrix[0, 0]))
+    sign_y   = int(np.round(matrix[1, 1]))
+    offset_x = -sign_x * int(np.round(matrix[0, 2]))
+    offset_y = -sign_y * int(np.round(matrix[1, 2]))
+
+    border_mode = params.cvBorderMode()
+    rows    = _source_indices(sign_y, offset_y, output_shape[0], image.shape[0], border_mode)
+    columns = _source_indices(sign_x, offset_x, output_shape[1], image.shape[1], border_mode)
+    if rows is None or columns is None:
+        return None
+
+    rows, rows_inside       = rows
+    columns, columns_inside = columns
+
+    fill = None
+    if border_mode == cv2.BORDER_CONSTANT and not (rows_inside.all() and columns_inside.all()):
+        # determine the fill value the way cv2 interprets cval for this image
+        translation = np.array([[1, 0, 2], [0, 1, 2]], dtype=np.float64)
+        fill = cv2.warpAffine(image[:1, :1], translation, (1, 1), borderMode=cv2.BORDER_CONSTANT, borderValue=params.cval)
+
+    output = np.empty(tuple(output_shape) + image.shape[2:], dtype=image.dtype)
+
+    if not rows_inside.any() or not columns_inside.any():
+        output[...] = image[rows[:, np.newaxis], columns] if fill is None else fill
+        return output
+
+    # the output pixels that come from inside the image form one block, which is a (possibly flipped) slice of the image
+    inside_rows    = np.flatnonzero(rows_inside)
+    inside_columns = np.flatnonzero(columns_inside)
+    r0, r1 = inside_rows[0], inside_rows[-1] + 1
+    c0, c1 = inside_columns[0], inside_columns[-1] + 1
+    block  = image[min(rows[r0], rows[r1 - 1]):max(rows[r0], rows[r1 - 1]) + 1, min(columns[c0], columns[c1 - 1]):max(columns[c0], columns[c1 - 1]) + 1]
+
+    # cv2.flip is much faster than copying a negative stride view
+    if sign_x < 0 and sign_y < 0:
+        block = cv2.flip(block, -1)
+    elif sign_x < 0:
+        block = cv2.flip(block, 1)
+    elif sign_y < 0:
+        block = cv2.flip(block, 0)
+    output[r0:r1, c0:c1] = block.reshape(output[r0:r1, c0:c1].shape)
+
+    # fill the borders around that block
+    border_rows    = np.flatnonzero(~rows_inside)
+    border_columns = np.flatnonzero(~columns_inside)
+    if fill is not None:
+        output[border_rows] = fill
+        output[r0:r1, border_columns] = fill
+    else:
+        output[border_rows] = image[rows[border_rows][:, np.newaxis], columns]
+        output[r0:r1, border_columns] = image[rows[r0:r1][:, np.newaxis], columns[border_columns]]
+
+    return output
+
+
 def compute_resize_scale(image_shape, min_side=800, max_side=1333):
     """ Compute an image scale such that the image size is constrained to min_side and max_side.
 
@@ -179,6 +355,16 @@ def compute_resize_scale(image_shape, min_side=800, max_side=1333):
     return scale
 
 
+def resized_shape(image_shape, scale):
+    """ Compute the (height, width) of an image after resizing it with scale, like cv2.resize does.
+
+    Args
+        image_shape: The shape of the image, only the first two dimensions are used.
+        scale: The resizing scale.
+    """
+    return int(round(image_shape[0] * scale)), int(round(image_shape[1] * scale))
+
+
 def resize_image(img, min_side=800, max_side=1333):
     """ Resize an image such that the size is constrained to min_side and max_side.
 
@@ -192,6 +378,10 @@ def resize_image(img, min_side=800, max_side=1333):
     # compute scale to resize the image
     scale = compute_resize_scale(img.shape, min_side=min_side, max_side=max_side)
 
+    # images can already have the right size, for example when loaded from a cache of resized images
+    if scale == 1:
+        return img, scale
+
     # resize the image with the computed scale
     img = cv2.resize(img, None, fx=scale, fy=scale)
 
@@ -261,6 +451,8 @@ class VisualEffect:
         Args
             image: Image to adjust
         """
+        if image.dtype == np.uint8 and image.ndim == 3 and image.shape[2] == 3:
+            return self.apply_lut(image)
 
         if self.contrast_factor:
             image = adjust_contrast(image, self.contrast_factor)
@@ -280,6 +472,61 @@ class VisualEffect:
 
         return image
 
+    def color_lut(self, image):
+        """ Returns a per channel lookup table of shape (256, 1, 3) applying the contrast and brightness adjustments, or None.
+
+        Args
+            image: The uint8 image to adjust, its mean is needed for the contrast adjustment.
+        """
+        if not self.contrast_factor and not self.brightness_delta:
+            return None
+
+        values = np.arange(256, dtype=np.uint8)
+        lut    = np.repeat(values[:, np.newaxis], 3, axis=1)
+        if self.contrast_factor:
+            mean = image.mean(axis=0).mean(axis=0)
+            lut  = adjust_contrast(lut, self.contrast_factor, mean=mean)
+        if self.brightness_delta:
+            lut  = adjust_brightness(lut, self.brightness_delta)
+
+        return lut.reshape((256, 1, 3))
+
+    def hsv_lut(self):
+        """ Returns a per channel lookup table of shape (256, 1, 3) applying the hue and saturation adjustments to HSV pixels, or None.
+        """
+        if not self.hue_delta and not self.saturation_factor:
+            return None
+
+        values = np.arange(256, dtype=np.uint8)
+        lut    = np.repeat(values[:, np.newaxis], 3, axis=1)
+        if self.hue_delta:
+            lut = adjust_hue(lut, self.hue_delta)
+        if self.saturation_factor:
+            lut = adjust_saturation(lut, self.saturation_factor)
+
+        return lut.reshape((256, 1, 3))
+
+    def apply_lut(self, image):
+        """ Apply the visual effect on a uint8 image with lookup tables.
+
+        The adjustments only depend on the value of a pixel in each channel (and the mean of each channel for contrast),
+        so they are evaluated once for all 256 values and applied with cv2.LUT, giving the same result as the float computations.
+
+        Args
+            image: uint8 BGR image to adjust, it is not modified.
+        """
+        lut = self.color_lut(image)
+        if lut is not None:
+            image = cv2.LUT(image, lut)
+
+        lut = self.hsv_lut()
+        if lut is not None:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+            cv2.LUT(image, lut, dst=image)
+            image = cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
+
+        return image
+
 
 def random_visual_effect_generator(
     contrast_range=(0.9, 1.1),
@@ -314,14 +561,16 @@ def random_visual_effect_generator(
     return _generate()
 
 
-def adjust_contrast(image, factor):
+def adjust_contrast(image, factor, mean=None):
     """ Adjust contrast of an image.
 
     Args
         image: Image to adjust.
         factor: A factor for adjusting contrast.
+        mean: The mean of each channel (defaults to the mean of image).
     """
-    mean = image.mean(axis=0).mean(axis=0)
+    if mean is None:
+        mean = image.mean(axis=0).mean(axis=0)
     return _clip((image - mean) * factor + mean)
 
 
@@ -39,19 +39,35 @@ def transform_aabb(transform, aabb):
     Returns
         The new AABB as tuple (x1, y1, x2, y2)
     """
-    x1, y1, x2, y2 = aabb
-    # Transform all 4 corners of the AABB.
-    points = transform.dot([
-        [x1, x2, x1, x2],
-        [y1, y2, y2, y1],
-        [1,  1,  1,  1 ],
-    ])
+    return list(transform_aabbs(transform, [aabb])[0])
+
+
+def transform_aabbs(transform, aabbs):
+    """ Apply a transformation to an array of axis aligned bounding boxes.
+
+    All corner points of all boxes are transformed with a single matrix product.
+
+    Args
+        transform: The transformation to apply.
+        aabbs:     np.array of shape (N, 4) for (x1, y1, x2, y2).
+    Returns
+        np.array of shape (N, 4) with the new AABBs.
+    """
+    aabbs = np.asarray(aabbs, dtype=np.float64)
+    x1, y1, x2, y2 = aabbs[:, 0], aabbs[:, 1], aabbs[:, 2], aabbs[:, 3]
+
+    # Transform all 4 corners of every AABB, the points have shape (2, N, 4).
+    points = np.asarray(transform)[:2].dot(np.stack([
+        np.stack([x1, x2, x1, x2], axis=1),
+        np.stack([y1, y2, y2, y1], axis=1),
+        np.ones((aabbs.shape[0], 4)),
+    ]).reshape(3, -1)).reshape(2, -1, 4)
 
     # Extract the min and max corners again.
-    min_corner = points.min(axis=1)
-    max_corner = points.max(axis=1)
+    min_corner = points.min(axis=2)
+    max_corner = points.max(axis=2)
 
-    return [min_corner[0], min_corner[1], max_corner[0], max_corner[1]]
+    return np.stack([min_corner[0], min_corner[1], max_corner[0], max_corner[1]], axis=1)
 
 
 def _random_vector(min, max, prng=DEFAULT_PRNG):
@@ -249,6 +265,25 @@ def random_transform(
     ])
 
 
+class RandomTransformGenerator(object):
+    """ Iterator of random transformations, see random_transform_generator.
+
+    The PRNG is kept as an attribute, so it can be reseeded (for example in each process that computes batches).
+    """
+
+    def __init__(self, prng, **kwargs):
+        self.prng   = prng
+        self.kwargs = kwargs
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return random_transform(prng=self.prng, **self.kwargs)
+
+    next = __next__
+
+
 def random_transform_generator(prng=None, **kwargs):
     """ Create a random transform generator.
 
@@ -285,5 +320,4 @@ def random_transform_generator(prng=None, **kwargs):
         # RandomState automatically seeds using the best available method.
         prng = np.random.RandomState()
 
-    while True:
-        yield random_transform(prng=prng, **kwargs)
+    return RandomTransformGenerator(prng, **kwargs)
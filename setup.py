@@ -27,6 +27,8 @@ setup(
                         ],
     ext_modules       = [
         Extension('object_detection_retinanet.utils.compute_overlap', ['object_detection_retinanet/utils/compute_overlap.pyx'],
-        include_dirs = [numpy.get_include()])
+        include_dirs = [numpy.get_include()],
+        extra_compile_args = ['-fopenmp'],
+        extra_link_args = ['-fopenmp'])
     ]
 )
\ No newline at end of file
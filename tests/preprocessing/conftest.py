@@ -0,0 +1,52 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def csv_dataset(tmpdir):
+    """ A small CSV dataset of random images, with several annotations per image and one image without annotations.
+
+    Returns
+        The annotations and classes data frames, and the directory of the images.
+    """
+    random = np.random.RandomState(0)
+    base_dir = str(tmpdir.mkdir('images'))
+
+    rows = []
+    for i in range(9):
+        height, width = random.randint(100, 300), random.randint(100, 400)
+        name = 'image{:02d}.jpg'.format(i)
+        Image.fromarray(random.randint(0, 255, (height, width, 3)).astype(np.uint8)).save(os.path.join(base_dir, name))
+
+        if i == 4:
+            rows.append((name, '', '', '', '', ''))
+            continue
+
+        for k in range(random.randint(1, 4)):
+            x1, y1 = random.randint(0, width // 2), random.randint(0, height // 2)
+            x2, y2 = x1 + random.randint(10, width // 2), y1 + random.randint(10, height // 2)
+            rows.append((name, x1, y1, x2, y2, ['cat', 'dog'][k % 2]))
+
+    annotations = pd.DataFrame(rows, columns=['img_file', 'x1', 'y1', 'x2', 'y2', 'class_name'])
+    classes     = pd.DataFrame([('cat', 0), ('dog', 1)], columns=['class_name', 'class_id'])
+    return annotations, classes, base_dir
@@ -0,0 +1,110 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pickle
+
+import numpy as np
+import pytest
+
+from object_detection_retinanet.preprocessing.annotation_store import (
+    AnnotationStore,
+    AnnotationStoreBuilder,
+    AnnotationStoreWriter,
+)
+
+
+def random_annotations(prng, num_images):
+    """ Annotations of every image as lists, about half of the images have none.
+    """
+    images = []
+    for _ in range(num_images):
+        count = prng.randint(0, 4) if prng.rand() < 0.5 else 0
+        images.append({
+            'bboxes' : prng.uniform(0, 100, (count, 4)).astype(np.float32).tolist(),
+            'labels' : prng.randint(0, 5, count).tolist(),
+            'weights': prng.uniform(0, 1, count).astype(np.float32).tolist(),
+        })
+    return images
+
+
+def assert_store_matches(store, images):
+    assert len(store) == len(images)
+    assert store.num_annotations() == sum(len(image['labels']) for image in images)
+    for image_index, image in enumerate(images):
+        annotations = store.get(image_index)
+        assert store.num_annotations(image_index) == len(image['labels'])
+        np.testing.assert_array_equal(annotations['bboxes'], np.array(image['bboxes'], dtype=np.float32).reshape((-1, 4)))
+        np.testing.assert_array_equal(annotations['labels'], image['labels'])
+        np.testing.assert_array_equal(annotations['weights'], np.array(image['weights'], dtype=np.float32))
+        assert annotations['bboxes'].dtype == np.float32 and annotations['labels'].dtype == np.int32
+        assert not annotations['bboxes'].flags.writeable
+
+
+def test_from_image_indices():
+    prng   = np.random.RandomState(0)
+    images = random_annotations(prng, 50)
+
+    # the annotations of all images in a random order, as (image index, annotation index) pairs
+    rows = [(image_index, k) for image_index, image in enumerate(images) for k in range(len(image['labels']))]
+    rows = [rows[i] for i in prng.permutation(len(rows))]
+
+    store = AnnotationStore.from_image_indices(
+        [image_index for image_index, _ in rows],
+        np.array([images[i]['bboxes'][k] for i, k in rows]).reshape((-1, 4)),
+        np.array([images[i]['labels'][k] for i, k in rows]),
+        len(images),
+        columns={'weights': np.array([images[i]['weights'][k] for i, k in rows], dtype=np.float32)},
+    )
+
+    # the annotations of an image keep the order in which they appear in the rows
+    expected = []
+    for image_index, image in enumerate(images):
+        order = [k for i, k in rows if i == image_index]
+        expected.append(dict((name, [image[name][k] for k in order]) for name in image))
+
+    assert_store_matches(store, expected)
+    assert_store_matches(pickle.loads(pickle.dumps(store)), expected)
+
+
+@pytest.mark.parametrize('chunk_size', [2, 65536])
+def test_builder_and_writer(tmpdir, chunk_size):
+    images = random_annotations(np.random.RandomState(1), 50)
+
+    builder = AnnotationStoreBuilder(columns={'weights': np.float32})
+    writer  = AnnotationStoreWriter(str(tmpdir), columns={'weights': np.float32})
+    builder.chunk_size = chunk_size
+    writer.chunk_size  = chunk_size
+    for image in images:
+        builder.add_image(**image)
+        writer.add_image(**image)
+
+        # the annotation counts of images without annotations are flushed too
+        assert len(builder.counts) < chunk_size and len(writer.counts) < chunk_size
+
+    assert_store_matches(builder.build(), images)
+
+    store = writer.build()
+    assert store.directory == str(tmpdir)
+    assert_store_matches(store, images)
+    assert_store_matches(pickle.loads(pickle.dumps(store)), images)
+
+
+def test_open_incomplete(tmpdir):
+    writer = AnnotationStoreWriter(str(tmpdir))
+    writer.add_image([[0, 0, 1, 1]], [0])
+    with pytest.raises(IOError):
+        AnnotationStore.open(str(tmpdir))
+
@@ -0,0 +1,102 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from object_detection_retinanet.preprocessing.annotation_store import AnnotationStoreWriter
+from object_detection_retinanet.preprocessing.csv_generator import CSVGenerator, index_csv_annotations
+
+
+def test_data_frames(csv_dataset):
+    annotations, classes, base_dir = csv_dataset
+    generator = CSVGenerator(annotations, classes, base_dir, None, None, group_method='none', shuffle_groups=False)
+
+    # reference, the rows of every image in the order they appear
+    class_ids = dict(zip(classes['class_name'], classes['class_id']))
+    expected  = OrderedDict()
+    for row in annotations.itertuples(index=False):
+        image = expected.setdefault(row.img_file, {'bboxes': [], 'labels': []})
+        if row.class_name:
+            image['bboxes'].append([row.x1, row.y1, row.x2, row.y2])
+            image['labels'].append(class_ids[row.class_name])
+
+    assert generator.size() == len(expected)
+    for image_index, (name, image) in enumerate(expected.items()):
+        assert generator.image_names[image_index] == name
+        loaded = generator.load_annotations(image_index)
+        np.testing.assert_array_equal(loaded['bboxes'], np.array(image['bboxes'], dtype=np.float32).reshape((-1, 4)))
+        np.testing.assert_array_equal(loaded['labels'], image['labels'])
+
+
+def test_data_frames_unknown_class(csv_dataset):
+    annotations, classes, base_dir = csv_dataset
+    annotations = pd.concat([annotations, pd.DataFrame([('image00.jpg', 1, 2, 3, 4, 'bird')], columns=annotations.columns)])
+    with pytest.raises(ValueError):
+        CSVGenerator(annotations, classes, base_dir, None, None)
+
+
+def write_csv(annotations, classes, directory):
+    annotations_path = os.path.join(directory, 'annotations.csv')
+    classes_path     = os.path.join(directory, 'classes.csv')
+    annotations.to_csv(annotations_path, header=False, index=False)
+    classes.to_csv(classes_path, header=False, index=False)
+    return annotations_path, classes_path
+
+
+@pytest.mark.parametrize('chunk_size', [2, 65536])
+def test_index(csv_dataset, tmpdir, monkeypatch, chunk_size):
+    monkeypatch.setattr(AnnotationStoreWriter, 'chunk_size', chunk_size)
+    annotations, classes, base_dir = csv_dataset
+    annotations_path, classes_path = write_csv(annotations, classes, str(tmpdir))
+
+    index_dir = str(tmpdir.join('index'))
+    expected  = CSVGenerator(annotations, classes, base_dir, None, None, group_method='none', shuffle_groups=False)
+    assert index_csv_annotations(annotations_path, classes_path, index_dir) == expected.size()
+
+    generator = CSVGenerator(None, None, base_dir, None, None, annotation_index=index_dir, group_method='none', shuffle_groups=False)
+    for indexed in [generator, pickle.loads(pickle.dumps(generator))]:
+        assert indexed.size() == expected.size()
+        assert indexed.classes == expected.classes
+        for image_index in range(expected.size()):
+            assert indexed.image_path(image_index) == expected.image_path(image_index)
+            annotations          = indexed.load_annotations(image_index)
+            expected_annotations = expected.load_annotations(image_index)
+            np.testing.assert_array_equal(annotations['bboxes'], expected_annotations['bboxes'])
+            np.testing.assert_array_equal(annotations['labels'], expected_annotations['labels'])
+
+
+def test_index_not_contiguous(csv_dataset, tmpdir):
+    annotations, classes, _ = csv_dataset
+
+    # move the last row of an image with several rows, other than the last image, to the end
+    counts = annotations['img_file'].value_counts()
+    image  = counts.index[(counts > 1) & (counts.index != annotations['img_file'].iloc[-1])][0]
+    rows   = annotations.index[annotations['img_file'] == image]
+    annotations = pd.concat([annotations.drop(rows[-1:]), annotations.loc[rows[-1:]]])
+    annotations_path, classes_path = write_csv(annotations, classes, str(tmpdir))
+
+    index_dir = str(tmpdir.join('index'))
+    with pytest.raises(ValueError):
+        index_csv_annotations(annotations_path, classes_path, index_dir)
+
+    # nothing of the partial index is left behind
+    assert os.listdir(index_dir) == []
@@ -0,0 +1,48 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+
+import numpy as np
+
+from object_detection_retinanet.preprocessing.csv_generator import CSVGenerator
+from object_detection_retinanet.preprocessing.prefetch import PrefetchGenerator
+
+
+def test_prefetch_matches_generator(csv_dataset, tmpdir):
+    annotations, classes, base_dir = csv_dataset
+    generator = CSVGenerator(annotations, classes, base_dir, None, None, num_io_workers=2, shuffle_groups=False)
+    generator.batch_size = 4
+    generator.group_images()
+
+    # the parent uses its thread pool before the workers are forked
+    expected = [generator.compute_input_output(group) for group in generator.groups]
+
+    shared_dir = str(tmpdir.mkdir('shared'))
+    prefetch   = PrefetchGenerator(generator, workers=2, shared_dir=shared_dir, seed=0)
+    try:
+        assert len(prefetch) == len(generator)
+        for index, (expected_inputs, expected_targets) in enumerate(expected):
+            inputs, targets = prefetch[index]
+            np.testing.assert_array_equal(inputs, expected_inputs)
+            assert len(targets) == len(expected_targets)
+            for target, expected_target in zip(targets, expected_targets):
+                np.testing.assert_array_equal(target, expected_target)
+    finally:
+        prefetch.close()
+
+    # every batch file was received or discarded, and the private directory of the workers is removed
+    assert os.listdir(shared_dir) == []
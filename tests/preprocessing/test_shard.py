@@ -0,0 +1,62 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import pickle
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from object_detection_retinanet.preprocessing.csv_generator import CSVGenerator
+from object_detection_retinanet.preprocessing.shard import ShardGenerator, pack_shards
+
+
+def assert_same_dataset(generator, expected):
+    assert generator.size() == expected.size()
+    assert generator.num_classes() == expected.num_classes()
+    for label in range(expected.num_classes()):
+        assert generator.label_to_name(label) == expected.label_to_name(label)
+
+    for image_index in range(expected.size()):
+        assert generator.image_path(image_index) == expected.image_path(image_index)
+        assert generator.image_size(image_index) == expected.image_size(image_index)
+        np.testing.assert_array_equal(generator.load_image(image_index), expected.load_image(image_index))
+
+        annotations          = generator.load_annotations(image_index)
+        expected_annotations = expected.load_annotations(image_index)
+        np.testing.assert_array_equal(annotations['bboxes'], expected_annotations['bboxes'])
+        np.testing.assert_array_equal(annotations['labels'], expected_annotations['labels'])
+
+
+def test_pack_shards(csv_dataset, tmpdir):
+    annotations, classes, base_dir = csv_dataset
+
+    # a name that isn't ascii, names are stored utf-8 encoded
+    shutil.copy(os.path.join(base_dir, 'image00.jpg'), os.path.join(base_dir, u'bär.jpg'))
+    annotations = pd.concat([annotations, pd.DataFrame(
+        [(u'bär.jpg', 1, 2, 30, 40, 'dog')],
+        columns=annotations.columns
+    )], ignore_index=True)
+
+    generator  = CSVGenerator(annotations, classes, base_dir, None, None, group_method='none', shuffle_groups=False)
+    shard_dir  = str(tmpdir.join('shards'))
+    num_shards = pack_shards(generator, shard_dir, shard_bytes=100000)
+    assert num_shards > 1
+
+    shards = ShardGenerator(shard_dir, group_method='none', shuffle_groups=False)
+    assert_same_dataset(shards, generator)
+    assert_same_dataset(pickle.loads(pickle.dumps(shards)), generator)
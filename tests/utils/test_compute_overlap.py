@@ -0,0 +1,79 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import pytest
+
+import pyximport
+pyximport.install()
+from object_detection_retinanet.utils.compute_overlap import compute_overlap, compute_overlap_max, compute_overlap_max_pruned
+
+
+def random_boxes(prng, count, dtype):
+    """ Random boxes on a coarse integer grid, so some boxes are identical and their overlaps tie.
+    """
+    xy = prng.randint(0, 60, (count, 2))
+    wh = prng.randint(0, 40, (count, 2))
+    return np.concatenate([xy, xy + wh], axis=1).astype(dtype)
+
+
+def assert_matches_full_matrix(result, boxes, query_boxes, query_max):
+    overlaps = compute_overlap(boxes.astype(np.float64), query_boxes.astype(np.float64))
+
+    np.testing.assert_allclose(result[0], overlaps.max(axis=1) if overlaps.size else np.zeros(len(boxes)))
+    np.testing.assert_array_equal(result[1], overlaps.argmax(axis=1) if overlaps.size else np.zeros(len(boxes)))
+    if query_max:
+        np.testing.assert_allclose(result[2], overlaps.max(axis=0) if overlaps.size else np.zeros(len(query_boxes)))
+        np.testing.assert_array_equal(result[3], overlaps.argmax(axis=0) if overlaps.size else np.zeros(len(query_boxes)))
+    else:
+        assert len(result) == 2
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('query_max', [False, True])
+@pytest.mark.parametrize('num_threads', [1, 4])
+def test_compute_overlap_max(dtype, query_max, num_threads):
+    prng = np.random.RandomState(0)
+    for num_boxes, num_query_boxes in [(500, 30), (1, 1), (300, 1), (0, 5), (5, 0)]:
+        boxes       = random_boxes(prng, num_boxes, dtype)
+        query_boxes = random_boxes(prng, num_query_boxes, dtype)
+
+        result = compute_overlap_max(boxes, query_boxes, query_max=query_max, num_threads=num_threads)
+        assert_matches_full_matrix(result, boxes, query_boxes, query_max)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('query_max', [False, True])
+@pytest.mark.parametrize('num_threads', [1, 4])
+def test_compute_overlap_max_pruned(dtype, query_max, num_threads):
+    prng = np.random.RandomState(1)
+    for num_boxes, num_query_boxes in [(500, 30), (400, 200), (1, 1), (300, 1), (0, 5), (5, 0)]:
+        boxes       = random_boxes(prng, num_boxes, dtype)
+        query_boxes = random_boxes(prng, num_query_boxes, dtype)
+
+        result = compute_overlap_max_pruned(boxes, query_boxes, query_max=query_max, num_threads=num_threads)
+        assert_matches_full_matrix(result, boxes, query_boxes, query_max)
+
+
+def test_compute_overlap_max_pruned_wide_range():
+    """ Query boxes of very different widths end up in different classes of the interval index.
+    """
+    prng        = np.random.RandomState(2)
+    boxes       = np.concatenate([random_boxes(prng, 200, np.float64) * scale for scale in [1, 8, 64]])
+    query_boxes = np.concatenate([random_boxes(prng, 20, np.float64) * scale for scale in [1, 8, 64]])
+
+    result = compute_overlap_max_pruned(boxes, query_boxes, query_max=True)
+    assert_matches_full_matrix(result, boxes, query_boxes, True)
@@ -0,0 +1,111 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import cv2
+import numpy as np
+
+from object_detection_retinanet.utils.image import (
+    TransformParameters,
+    VisualEffect,
+    adjust_brightness,
+    adjust_contrast,
+    adjust_hue,
+    adjust_saturation,
+    apply_transform,
+    is_integer_flip_translation,
+)
+
+
+def float_visual_effect(effect, image):
+    """ Reference implementation, applying the adjustments of a VisualEffect to the whole image one after the other.
+    """
+    if effect.contrast_factor:
+        image = adjust_contrast(image, effect.contrast_factor)
+    if effect.brightness_delta:
+        image = adjust_brightness(image, effect.brightness_delta)
+
+    if effect.hue_delta or effect.saturation_factor:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        if effect.hue_delta:
+            image = adjust_hue(image, effect.hue_delta)
+        if effect.saturation_factor:
+            image = adjust_saturation(image, effect.saturation_factor)
+        image = cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
+
+    return image
+
+
+def test_visual_effect_lut():
+    prng = np.random.RandomState(0)
+    for _ in range(30):
+        image  = prng.randint(0, 256, (prng.randint(1, 50), prng.randint(1, 50), 3)).astype(np.uint8)
+        effect = VisualEffect(
+            contrast_factor=prng.choice([0, prng.uniform(0.5, 1.5)]),
+            brightness_delta=prng.choice([0, prng.uniform(-0.3, 0.3)]),
+            hue_delta=prng.choice([0, prng.uniform(-0.2, 0.2)]),
+            saturation_factor=prng.choice([0, prng.uniform(0.5, 1.5)]),
+        )
+
+        original = image.copy()
+        result   = effect(image)
+
+        assert result.dtype == np.uint8
+        np.testing.assert_array_equal(result, float_visual_effect(effect, image.copy()))
+        np.testing.assert_array_equal(image, original)
+
+
+def warp_affine(matrix, image, params, output_shape):
+    """ Reference implementation, warping the image with cv2.warpAffine.
+    """
+    return cv2.warpAffine(
+        image,
+        matrix[:2, :],
+        dsize       = (output_shape[1], output_shape[0]),
+        flags       = params.cvInterpolation(),
+        borderMode  = params.cvBorderMode(),
+        borderValue = params.cval,
+    )
+
+
+def test_integer_flip_translation():
+    prng = np.random.RandomState(0)
+    for dtype in [np.uint8, np.float32]:
+        for shape in [(7, 9, 3), (1, 5, 3), (6, 1, 3), (40, 30), (5, 4, 1)]:
+            image = (prng.rand(*shape) * 255).astype(dtype)
+            for fill_mode in ['constant', 'nearest', 'reflect', 'wrap']:
+                if fill_mode == 'reflect' and min(shape[:2]) == 1:
+                    continue
+
+                for interpolation in ['nearest', 'linear', 'cubic', 'area']:
+                    params = TransformParameters(fill_mode=fill_mode, interpolation=interpolation, cval=7)
+                    for flip_x in [1, -1]:
+                        for flip_y in [1, -1]:
+                            for tx, ty in [(0, 0), (1, 2), (-3, -1), (shape[1], shape[0]), (2 * shape[1] + 1, 0), (-25, 0)]:
+                                matrix = np.array([[flip_x, 0, tx], [0, flip_y, ty], [0, 0, 1]], dtype=np.float64)
+                                assert is_integer_flip_translation(matrix)
+
+                                for output_shape in [shape[:2], (shape[0] + 3, shape[1] + 1)]:
+                                    result   = apply_transform(matrix, image, params, output_shape)
+                                    expected = warp_affine(matrix, image, params, output_shape)
+                                    assert result.shape == expected.shape and result.dtype == expected.dtype
+                                    np.testing.assert_array_equal(result, expected)
+
+
+def test_is_integer_flip_translation():
+    assert is_integer_flip_translation(np.array([[-1, 0, 10], [0, 1, -3], [0, 0, 1]], dtype=np.float64))
+    assert not is_integer_flip_translation(np.array([[1, 0, 0.5], [0, 1, 0], [0, 0, 1]], dtype=np.float64))
+    assert not is_integer_flip_translation(np.array([[1.1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64))
+    assert not is_integer_flip_translation(np.array([[0, 1, 0], [1, 0, 0], [0, 0, 1]], dtype=np.float64))
@@ -0,0 +1,61 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from object_detection_retinanet.utils.transform import random_transform, transform_aabb, transform_aabbs
+
+
+def corner_transform_aabb(transform, aabb):
+    """ Reference implementation, transforming the four corners of a single box.
+    """
+    x1, y1, x2, y2 = aabb
+    points = transform.dot([
+        [x1, x2, x1, x2],
+        [y1, y2, y2, y1],
+        [1,  1,  1,  1 ],
+    ])
+    min_corner = points.min(axis=1)
+    max_corner = points.max(axis=1)
+    return [min_corner[0], min_corner[1], max_corner[0], max_corner[1]]
+
+
+def test_transform_aabbs():
+    prng = np.random.RandomState(0)
+    for _ in range(20):
+        transform = random_transform(
+            min_rotation=-0.5,
+            max_rotation=0.5,
+            min_translation=(-10, -10),
+            max_translation=(10, 10),
+            min_shear=-0.2,
+            max_shear=0.2,
+            min_scaling=(0.8, 0.8),
+            max_scaling=(1.2, 1.2),
+            flip_x_chance=0.5,
+            flip_y_chance=0.5,
+            prng=prng,
+        )
+        xy    = prng.uniform(0, 500, (15, 2))
+        aabbs = np.concatenate([xy, xy + prng.uniform(1, 200, (15, 2))], axis=1)
+
+        expected = np.array([corner_transform_aabb(transform, aabb) for aabb in aabbs])
+        np.testing.assert_allclose(transform_aabbs(transform, aabbs), expected)
+        np.testing.assert_allclose(transform_aabb(transform, aabbs[0]), expected[0])
+
+
+def test_transform_aabbs_empty():
+    assert transform_aabbs(np.identity(3), np.zeros((0, 4))).shape == (0, 4)